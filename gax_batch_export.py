@@ -0,0 +1,224 @@
+from libs.shinen_gax  import unpack_GAX_file
+from libs.gax_render  import offline_renderer, get_wave_name
+from libs.gax_analyzer import analyze_song
+from libs.wav_stream  import wav_stream_writer, wav_formats
+
+import os
+import time
+import argparse
+import concurrent.futures
+
+
+'''
+Batch song renderer. Renders every song (or a range of songs) of many .gax files,
+spreading the songs over a pool of worker processes.
+
+Finished jobs are logged to a journal in the output folder, so an interrupted
+run can be picked back up with --resume.
+'''
+
+
+## vars ##
+
+fps = 59.7275
+journal_name = "batch_journal.txt"
+
+module_cache = dict() # per worker process: .gax path -> unpacked module
+
+
+## funcs ##
+
+def load_module(gax_path):
+
+	# every worker unpacks a file once, then reuses it for all of that file's songs
+	try:
+		return module_cache[gax_path]
+	except KeyError:
+		pass
+
+	with open(gax_path, "rb") as f:
+		try:
+			gax_obj = unpack_GAX_file(f.read())
+		except:
+			raise Exception("Could not unpack {} as the program couldn't detect it as a .gax file".format(os.path.basename(gax_path))) from None
+
+	module_cache[gax_path] = gax_obj
+	return gax_obj
+
+
+def parse_song_range(song_range, song_count):
+
+	'''
+	"0-3,7" -> [0, 1, 2, 3, 7]. An empty range selects every song.
+	'''
+
+	if not song_range:
+		return list(range(song_count))
+
+	songs = list()
+	for part in song_range.split(','):
+		if '-' in part:
+			start, end = part.split('-')
+			songs.extend(range(int(start), int(end)+1))
+		else:
+			songs.append(int(part))
+
+	return [i for i in songs if i < song_count]
+
+
+def find_gax_files(paths):
+	gax_paths = list()
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, files in os.walk(path):
+				for name in sorted(files):
+					if name.lower().endswith(('.gax', '.o')):
+						gax_paths.append(os.path.realpath(os.path.join(root, name)))
+		else:
+			gax_paths.append(os.path.realpath(path))
+	return gax_paths
+
+
+def get_job_key(job):
+	return "{}|{}|{}|{}|{}.{}|{}".format(job["path"], job["song_idx"], job["loops"], job["rate"], *job["version"], job["format"])
+
+
+def read_journal(journal_path):
+	done = set()
+	if os.path.exists(journal_path):
+		with open(journal_path, "r", encoding="utf-8") as f:
+			for line in f:
+				if line.strip():
+					done.add(line.split('\t')[0])
+	return done
+
+
+def estimate_job(job):
+
+	# song length in seconds without rendering it; 0 if the sequencer data can't be read
+	try:
+		return analyze_song(load_module(job["path"]), job["song_idx"]).get_duration(job["loops"], fps)
+	except Exception:
+		return 0
+
+
+def render_job(job):
+
+	'''
+	Runs in a worker process. Renders one song to a temporary file and only
+	moves it into place once it's complete.
+	'''
+
+	start_time = time.perf_counter()
+
+	gax_obj  = load_module(job["path"])
+	renderer = offline_renderer(gax_obj, job["song_idx"], rate=job["rate"],
+		version=job["version"], fps=fps, output_format=job["format"])
+
+	output_dir = os.path.join(job["output_path"], os.path.basename(job["path"]))
+	os.makedirs(output_dir, exist_ok=True)
+	wave_path = os.path.join(output_dir, get_wave_name(gax_obj, job["song_idx"], renderer.mixing_rate))
+
+	frame_count = 0
+	with wav_stream_writer(wave_path + ".part", renderer.mixing_rate, sample_format=job["format"]) as wav_file:
+		for block in renderer.render_ticks(job["loops"], reuse_loops=True):
+			wav_file.write_block(block)
+			frame_count += len(block) // wav_file.sample_width
+
+	os.replace(wave_path + ".part", wave_path)
+
+	return {
+		"wave_path": wave_path,
+		"seconds": time.perf_counter() - start_time,
+		"audio_seconds": frame_count / renderer.mixing_rate
+	}
+
+
+## main ##
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('file_paths', nargs='+', help=".gax/.o files (or folders of them) to render")
+	parser.add_argument('--songs', default="", help="Songs to render from each file, e.g. 0-3,7. Renders every song by default")
+	parser.add_argument('--loops', default=1, type=int, help="Number of times to repeat each song. Does nothing on one-shot jingles")
+	parser.add_argument('--hqx', action='store_true', help="Render at 48khz instead of each song's own mixing rate")
+	parser.add_argument('--maj', default=3, type=int, help="The major version of GAX to emulate")
+	parser.add_argument('--min', default=5, type=int, help="The minor version of GAX to emulate")
+	parser.add_argument('--jobs', default=0, type=int, help="Number of worker processes. Uses every core by default")
+	parser.add_argument('--output', default=os.path.join(os.getcwd(), "song_export"), help="Output folder")
+	parser.add_argument('--format', default="uint8", choices=list(wav_formats), help="Sample format of the .wav files. uint8 is the authentic 8-bit output")
+	parser.add_argument('--resume', action='store_true', help="Skip the songs a previous run already finished")
+
+	args = parser.parse_args()
+
+	os.makedirs(args.output, exist_ok=True)
+	journal_path = os.path.join(args.output, journal_name)
+
+	if args.resume:
+		done = read_journal(journal_path)
+	else:
+		done = set()
+		open(journal_path, "w").close()
+
+	# build the job list
+	jobs = list()
+	for gax_path in find_gax_files(args.file_paths):
+		try:
+			song_count = load_module(gax_path).get_song_count()
+		except Exception as e:
+			print("> skipping {}: {}".format(gax_path, e))
+			continue
+
+		for song_idx in parse_song_range(args.songs, song_count):
+			job = {
+				"path": gax_path,
+				"song_idx": song_idx,
+				"loops": args.loops,
+				"rate": 48000 if args.hqx else 0,
+				"version": (args.maj, args.min),
+				"format": args.format,
+				"output_path": args.output
+			}
+			if get_job_key(job) not in done:
+				job["estimate"] = estimate_job(job)
+				jobs.append(job)
+
+	module_cache.clear() # the workers load their own copies
+
+	# longest songs first, so one long song doesn't end up running alone at the end
+	jobs.sort(key=lambda job: job["estimate"], reverse=True)
+
+	print("> {} songs to render ({} already done), about {:.1f} minutes of audio".format(len(jobs), len(done),
+		sum(job["estimate"] for job in jobs) / 60))
+
+	start_time = time.perf_counter()
+	finished = 0
+	failed   = 0
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None) as pool:
+
+		futures = {pool.submit(render_job, job): job for job in jobs}
+
+		with open(journal_path, "a", encoding="utf-8") as journal:
+
+			for future in concurrent.futures.as_completed(futures):
+				job = futures[future]
+				finished += 1
+
+				try:
+					result = future.result()
+				except Exception as e:
+					failed += 1
+					print("[{}/{}] {} #{:0>2X} failed: {}".format(finished, len(jobs),
+						os.path.basename(job["path"]), job["song_idx"], e))
+					continue
+
+				print("[{}/{}] {} #{:0>2X} | {:.1f}s | {:.1f}x realtime".format(finished, len(jobs),
+					os.path.basename(job["path"]), job["song_idx"], result["seconds"],
+					result["audio_seconds"] / max(result["seconds"], 1e-9)))
+
+				journal.write("{}\t{:.3f}\n".format(get_job_key(job), result["seconds"]))
+				journal.flush()
+
+	print("\n> done in {:.1f}s, {} failed".format(time.perf_counter() - start_time, failed))
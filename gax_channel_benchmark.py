@@ -0,0 +1,116 @@
+from libs.shinen_gax   import unpack_GAX_file
+from libs.gax_replayer import channel
+from libs.gax_render   import offline_renderer
+
+import os
+import sys
+import time
+import timeit
+import argparse
+
+
+'''
+Benchmark for the replayer's channel state.
+Compares the __slots__ channel against the same class backed by a regular __dict__:
+attribute access in a loop shaped like tick_audio's per-sample loop, memory per channel,
+and (given a .gax file) a full render with the per-sample python engine.
+'''
+
+
+## funcs ##
+
+def make_dict_channel():
+
+	# same methods, but without __slots__, so every instance gets a __dict__ again
+	namespace = {name: value for name, value in vars(channel).items()
+				 if name not in channel.__slots__ and name not in ["__slots__", "__dict__", "__weakref__"]}
+	return type("dict_channel", (), namespace)
+
+
+def per_sample_loop(ch, sample_count):
+
+	# the attribute traffic of one tick_audio sample, without the waveform read
+	for i in range(sample_count):
+		ch.wave_position += ch.wave_step_rate*ch.wave_direction
+		if ch.wave_position >= 4096:
+			ch.wave_position = 0
+		ch.semitone    += ch.note_slide_amount/3
+		ch.semitone    += ch.tone_porta_lerp/3
+		ch.step_volume += ch.vol_slide_amount/3
+		ch.wave_output  = 64 * (((ch.perf_row_volume/255) * ch.step_volume/255) * ch.volenv_cur_vol/255)
+		ch.wave_output *= ch.mix_volume
+
+
+def get_channel_size(ch):
+	size = sys.getsizeof(ch)
+	if hasattr(ch, "__dict__"):
+		size += sys.getsizeof(ch.__dict__)
+	return size
+
+
+def copy_channels(channels, channel_class):
+	copies = list()
+	for ch in channels:
+		new_ch = channel_class()
+		for name in channel.__slots__:
+			setattr(new_ch, name, getattr(ch, name))
+		copies.append(new_ch)
+	return copies
+
+
+def time_render(renderer, ticks):
+	start_time = time.perf_counter()
+	sample_count = 0
+	for i in range(ticks):
+		if renderer.is_finished(1):
+			break
+		sample_count += len(renderer.render_tick())
+	return sample_count, time.perf_counter() - start_time
+
+
+## main ##
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('file_path', nargs='?', help=".gax/.o file to render (optional)")
+	parser.add_argument('--idx', default=0, type=int, help="Song in file to render")
+	parser.add_argument('--ticks', default=600, type=int, help="Number of ticks to render")
+	parser.add_argument('--samples', default=263, type=int, help="Samples per tick for the access benchmark")
+	parser.add_argument('--replayers', default=1000, type=int, help="Replayer count for the memory estimate")
+	args = parser.parse_args()
+
+	dict_channel = make_dict_channel()
+
+	# attribute access
+	print("> per-sample attribute access ({} samples per tick)".format(args.samples))
+	results = dict()
+	for name, channel_class in [("__dict__", dict_channel), ("__slots__", channel)]:
+		ch = channel_class()
+		ch.wave_step_rate = 0.37
+		number = 200
+		seconds = min(timeit.repeat(lambda: per_sample_loop(ch, args.samples), number=number, repeat=5))
+		results[name] = seconds / (number * args.samples) * 1e9
+		print("  {:<10} {:.1f} ns per sample".format(name, results[name]))
+	print("  {:.1f}% faster".format((1 - results["__slots__"]/results["__dict__"]) * 100))
+
+	# memory
+	dict_size  = get_channel_size(dict_channel())
+	slots_size = get_channel_size(channel())
+	print("\n> memory per channel")
+	print("  __dict__   {} bytes".format(dict_size))
+	print("  __slots__  {} bytes".format(slots_size))
+	print("  saves {:.1f} KiB over {} replayers with 16 channels each".format(
+		(dict_size - slots_size) * 16 * args.replayers / 1024, args.replayers))
+
+	# full render
+	if args.file_path:
+		with open(os.path.realpath(args.file_path), "rb") as f:
+			gax_obj = unpack_GAX_file(f.read())
+
+		print("\n> rendering {} ticks of song #{:0>2X} with the python engine".format(args.ticks, args.idx))
+		for name, channel_class in [("__dict__", dict_channel), ("__slots__", channel)]:
+			renderer = offline_renderer(gax_obj, args.idx, engine="python")
+			renderer.vars.channels = copy_channels(renderer.vars.channels, channel_class)
+			sample_count, seconds = time_render(renderer, args.ticks)
+			print("  {:<10} {:.2f}s | {:.0f} samples/s".format(name, seconds, sample_count / max(seconds, 1e-9)))
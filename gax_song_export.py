@@ -1,28 +1,27 @@
 from libs.shinen_gax  import *
-from libs.gax_wrapper import gax_replayer
-from libs.general     import sign_flip
+from libs.gax_render  import offline_renderer, get_wave_name
+from libs.gax_analyzer import analyze_song
+from libs.gax_segment_cache import segment_cache
+from libs.gax_parallel import render_parallel
+from libs.gax_resample import resampler, resample_ticks, qualities
+from libs.gax_control_log import record_control_log, render_control_log
+from libs.wav_stream  import wav_stream_writer, wav_formats
 
-import pyaudio
 import os
-import wave
 import argparse
+import contextlib
 
 
 ## vars ##
 
 fps = 59.7275
 max_loops = 2
-output_buffer = b''
 
 hqx_render = True
 
 
 ## funcs ##
 
-def gaxTitleToWindowsNT(song_title):
-	return re.sub(r"[\\\/:*?\"<>|]", "~", song_title, 0, re.MULTILINE)
-
-
 def setup_GAX(mus_path):
 
 	global gax_obj
@@ -41,57 +40,131 @@ def setup_GAX(mus_path):
 
 ## main ##
 
-parser = argparse.ArgumentParser()
-parser.add_argument('file_path', help=".gax/.o file to load")
-parser.add_argument('--idx', default=0, type=int, help="Song in file to load")
-parser.add_argument('--loops', default=1, type=int, help="Number of times to repeat the song. Does nothing on one-shot jingles")
-parser.add_argument('--hqx', default=False, type=bool, help="Whenever or not to render the specified track at 48khz")
-parser.add_argument('--maj', default=3, type=int, help="The major version of GAX to emulate")
-parser.add_argument('--min', default=5, type=int, help="The minor version of GAX to emulate")
-
-args = parser.parse_args()
-music_path = os.path.realpath(args.file_path)
-music_idx = args.idx
-hqx_render = args.hqx
-max_loops = args.loops
-
-
-if hqx_render:
-	mixing_rate = 48000
-else:
-	mixing_rate = 0
-
-# create output folder
-output_path = str(os.getcwd())+"\\song_export\\"
-try:
-	os.makedirs(output_path)
-except:
-	pass # path already exists
-
-
-setup_GAX(music_path)
-replayer = gax_replayer(gax_obj, None, music_idx, mixing_rate, fps)
-replayer.maj_version = args.maj
-replayer.min_version = args.min
-
-wave_name = "{:0>2X} ~ {} ({} khz).wav".format(
-	music_idx, 
-	gaxTitleToWindowsNT(gax_obj.get_song_name(music_idx)), 
-	int(replayer.mixing_rate/1000))
-
-print('Filename of output: {}\nOutput path: {}'.format(wave_name, output_path))
-
-while replayer.vars.speed[0] != 0: 
-
-	#luckily there is a way to know when the GAX song stops
-	#otherwise this would be computationally impossible to pull off (ever heard of the halting problem?)
-
-	output_buffer += replayer.GAX_play(debug=True)
-	if replayer.vars.loop_count >= max_loops+1:
-		break
-
-with wave.open(output_path + wave_name, mode="wb") as wav_file:
-	wav_file.setnchannels(1)
-	wav_file.setsampwidth(1)
-	wav_file.setframerate(replayer.mixing_rate)
-	wav_file.writeframes(sign_flip(output_buffer))
\ No newline at end of file
+# guarded so the worker processes of --parallel can import this file
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('file_path', help=".gax/.o file to load")
+	parser.add_argument('--idx', default=0, type=int, help="Song in file to load")
+	parser.add_argument('--loops', default=1, type=int, help="Number of times to repeat the song. Does nothing on one-shot jingles")
+	parser.add_argument('--hqx', default=False, type=bool, help="Whenever or not to render the specified track at 48khz")
+	parser.add_argument('--maj', default=3, type=int, help="The major version of GAX to emulate")
+	parser.add_argument('--min', default=5, type=int, help="The minor version of GAX to emulate")
+	parser.add_argument('--threaded', action='store_true', help="Write the .wav file on a separate thread while rendering")
+	parser.add_argument('--stems', action='store_true', help="Also write one .wav per channel, from the same render pass")
+	parser.add_argument('--cache-segments', action='store_true', help="Copy repeated pattern spans of each channel instead of rendering them again")
+	parser.add_argument('--parallel', action='store_true', help="Render the channels on separate CPU cores (needs NumPy)")
+	parser.add_argument('--resample', default=0, type=int, help="Render at the song's own mixing rate and convert the result to this rate, e.g. 48000")
+	parser.add_argument('--quality', default="medium", choices=list(qualities), help="Filter quality for --resample")
+	parser.add_argument('--engine', default=None, choices=["python", "numpy", "fixed"], help="Replayer engine. fixed uses integer fixed-point math like the GBA; numpy (or python without NumPy) by default")
+	parser.add_argument('--format', default="uint8", choices=list(wav_formats), help="Sample format of the .wav files. uint8 is the authentic 8-bit output")
+	parser.add_argument('--rates', default="", help="Also render at these mixing rates, e.g. 32768,48000. The sequencer and perf lists only run once for all of them")
+
+	args = parser.parse_args()
+	if args.parallel and args.stems:
+		parser.error("--parallel can't write --stems; render the stems without it")
+	if args.cache_segments and (args.parallel or args.stems):
+		parser.error("--cache-segments only works on the plain (serial, no --stems) render")
+	music_path = os.path.realpath(args.file_path)
+	music_idx = args.idx
+	hqx_render = args.hqx
+	max_loops = args.loops
+
+
+	if hqx_render:
+		mixing_rate = 48000
+	else:
+		mixing_rate = 0
+
+	# create output folder
+	output_path = str(os.getcwd())+"\\song_export\\"
+	try:
+		os.makedirs(output_path)
+	except:
+		pass # path already exists
+
+
+	setup_GAX(music_path)
+
+	# with --resample the mix comes out unquantized, and only gets quantized after the conversion
+	render_format = "float64" if args.resample else args.format
+
+	# headless; never opens an audio device
+	replayer = offline_renderer(gax_obj, music_idx, rate=mixing_rate,
+		version=(args.maj, args.min), fps=fps, engine=args.engine, output_format=render_format)
+
+	# with --resample the song is rendered at its own rate, only the written file is at the new rate
+	output_rate = args.resample if args.resample else replayer.mixing_rate
+
+	def resampled(blocks):
+		if args.resample:
+			return resample_ticks(blocks, replayer.mixing_rate, output_rate, args.quality, args.format, render_format)
+		return blocks
+
+	wave_name = get_wave_name(gax_obj, music_idx, output_rate)
+
+	print('Filename of output: {}\nOutput path: {}'.format(wave_name, output_path))
+
+	song_info = analyze_song(gax_obj, music_idx)
+	if song_info.is_one_shot:
+		print('Length: {:.1f}s (one-shot)'.format(song_info.get_duration(max_loops, fps)))
+	else:
+		print('Length: {:.1f}s (intro {:.1f}s, loop {:.1f}s)'.format(song_info.get_duration(max_loops, fps),
+			song_info.intro_ticks / fps, song_info.loop_ticks / fps))
+
+	# every tick goes straight to disk, so memory use stays flat no matter how long the song is
+	with contextlib.ExitStack() as files:
+
+		wav_file = files.enter_context(wav_stream_writer(output_path + wave_name, output_rate,
+			threaded=args.threaded, sample_format=args.format))
+
+		#luckily there is a way to know when the GAX song stops
+		#otherwise this would be computationally impossible to pull off (ever heard of the halting problem?)
+
+		if args.parallel:
+			for block in resampled(render_parallel(gax_obj, music_idx, max_loops, rate=mixing_rate,
+				version=(args.maj, args.min), fps=fps, engine=args.engine, output_format=render_format)):
+				wav_file.write_block(block)
+
+		elif not args.stems:
+			# later loops are copied from the first one once the replayer state repeats
+			for block in resampled(replayer.render_ticks(max_loops, reuse_loops=True,
+				segment_cache=segment_cache() if args.cache_segments else None)):
+				wav_file.write_block(block)
+
+		else:
+			stem_files = [files.enter_context(wav_stream_writer(
+				output_path + "{} - {}.wav".format(os.path.splitext(wave_name)[0], stem_name),
+				output_rate, threaded=args.threaded, sample_format=args.format)) for stem_name in replayer.get_stem_names()]
+
+			if not args.resample:
+				for block, stems in replayer.render_stem_ticks(max_loops):
+					wav_file.write_block(block)
+					for stem_file, stem in zip(stem_files, stems):
+						stem_file.write_block(stem)
+
+			else:
+				# one converter per output file
+				converters = [resampler(replayer.mixing_rate, output_rate, args.quality, args.format, render_format)
+							  for i in range(len(stem_files)+1)]
+				out_files  = [wav_file] + stem_files
+
+				for block, stems in replayer.render_stem_ticks(max_loops):
+					for out_file, converter, data in zip(out_files, converters, [block] + list(stems)):
+						out_file.write_block(converter.process_block(data))
+
+				for out_file, converter in zip(out_files, converters):
+					out_file.write_block(converter.flush_block())
+
+	# extra mixing rates, all played from one control pass
+	if args.rates:
+		control_log = record_control_log(gax_obj, music_idx, max_loops, version=(args.maj, args.min))
+
+		for rate in [int(rate) for rate in args.rates.split(',')]:
+			rate_name = get_wave_name(gax_obj, music_idx, rate)
+			print('Filename of output: {}'.format(rate_name))
+
+			with wav_stream_writer(output_path + rate_name, rate, threaded=args.threaded, sample_format=args.format) as wav_file:
+				for block in render_control_log(control_log, gax_obj, rate=rate, fps=fps, engine=args.engine,
+					output_format=args.format):
+					wav_file.write_block(block)
@@ -0,0 +1,204 @@
+from .gax_timeline import song_timeline
+
+import bisect
+
+'''
+Sequencer-only song analysis.
+Runs the replayer's row timing (speed, speed modulation, pattern breaks, restart position
+and the speed 0 end marker) without any channels or audio, a whole row at a time.
+Good for song lengths, loop points and render estimates without rendering anything.
+'''
+
+
+initial_speed = (6, 6) # what the replayer starts with
+
+
+class song_analysis:
+
+	'''
+	Timing of one song, in ticks (one tick = one replayer.tick call).
+
+	is_one_shot:  the song ends on its own (a speed of 0) instead of looping
+	end_tick:     tick count of the whole song if it ends, else None
+	intro_ticks:  ticks before the restart position is first reached; 0 when the song loops
+				  back to its start (the starting speed timer's lead-in isn't an intro)
+	first_pass_ticks: ticks up to and including the first wrap back to the restart position
+	loop_ticks:   length of one loop after that, or None for one-shots.
+				  if speed modulation makes loops differ, this is the first one;
+				  get_render_ticks accounts for all of them
+	rows:         (tick, position, step) for every row read, up to where playback repeats
+	'''
+
+	def __init__(self):
+
+		self.is_one_shot      = False
+		self.end_tick         = None
+		self.intro_ticks      = None
+		self.first_pass_ticks = None
+		self.loop_ticks       = None
+
+		self.rows       = list()
+		self.row_ticks  = list() # just the ticks of self.rows, for bisect
+		self.wrap_ticks = list() # tick of every wrap found
+
+		# playback repeats from cycle_start (a wrap) every cycle_ticks ticks,
+		# with cycle_wraps wraps per cycle
+		self.cycle_start = None
+		self.cycle_wrap  = None
+		self.cycle_ticks = None
+		self.cycle_wraps = None
+
+
+	def get_render_ticks(self, loops=1):
+
+		'''
+		Number of ticks offline_renderer.render_ticks(loops) produces
+		(it stops on the tick where loop_count reaches loops+1, or when the song ends).
+		'''
+
+		if self.is_one_shot:
+			if len(self.wrap_ticks) > loops:
+				return self.wrap_ticks[loops] + 1
+			return self.end_tick
+
+		wrap = loops # index of the wrap that stops the render
+		if wrap < len(self.wrap_ticks):
+			return self.wrap_ticks[wrap] + 1
+
+		# extend through the repeating part
+		cycles, offset = divmod(wrap - self.cycle_wrap, self.cycle_wraps)
+		return self.wrap_ticks[self.cycle_wrap + offset] + cycles*self.cycle_ticks + 1
+
+
+	def get_duration(self, loops=1, fps=59.7275):
+		# length of a render with that many loops, in seconds
+		return self.get_render_ticks(loops) / fps
+
+
+	def get_position(self, tick):
+
+		'''
+		(position, step) of the last row read at or before a tick; None before the first row.
+		'''
+
+		if self.cycle_start != None and tick > self.row_ticks[-1]:
+			tick = self.cycle_start + (tick - self.cycle_start - 1) % self.cycle_ticks + 1
+
+		idx = bisect.bisect_right(self.row_ticks, tick) - 1
+		if idx < 0:
+			return None
+		return self.rows[idx][1:]
+
+
+def get_sequencer_rows(timeline):
+
+	# per row: (speed to set or None, pattern break), from the events that affect timing.
+	# read_step applies these in channel order, so the last speed on a row wins
+	rows = dict()
+
+	for event in range(len(timeline.effect)):
+		effect = timeline.effect[event]
+		if effect not in (0x7, 0xD, 0xF):
+			continue
+
+		row = bisect.bisect_right(timeline.row_start, event) - 1
+		speed, skip = rows.get(row, (None, False))
+
+		if effect == 0x7:
+			speed = (timeline.param[event] & 0xf, timeline.param[event] >> 4)
+		elif effect == 0xF:
+			speed = (timeline.param[event],)*2
+		else:
+			skip = True
+
+		rows[row] = (speed, skip)
+
+	return rows
+
+
+def analyze_timeline(timeline, restart_position=0, max_wraps=64):
+
+	'''
+	Analyzes a song_timeline. Mirrors replayer.tick: a row is read on the tick where the
+	speed timer has run out, the speed pair gets flipped after every row (speed modulation),
+	and the next row comes speed[0] ticks later.
+	'''
+
+	analysis = song_analysis()
+	sequencer_rows = get_sequencer_rows(timeline)
+
+	step_count     = timeline.step_count
+	position_count = timeline.position_count
+
+	speed    = initial_speed
+	tick     = initial_speed[0] # the first row is read once the starting speed timer runs out
+	position = 0
+	step     = 0
+
+	wrap_states = dict()
+
+	while True:
+
+		if position == restart_position and step == 0 and analysis.intro_ticks == None:
+			analysis.intro_ticks = tick if restart_position != 0 else 0
+
+		# read the row (the tick itself is number `tick`, counting from 0)
+		analysis.rows.append((tick, position, step))
+		analysis.row_ticks.append(tick)
+
+		new_speed, skip = sequencer_rows.get(position*step_count + step, (None, False))
+		if new_speed != None:
+			speed = new_speed
+
+		step += 1
+		speed = speed[::-1] # allow for speed modulation
+
+		if step >= step_count or skip:
+			step = 0
+			position += 1
+
+			if position >= position_count:
+				position = restart_position
+
+				analysis.wrap_ticks.append(tick)
+				if analysis.first_pass_ticks == None:
+					analysis.first_pass_ticks = tick + 1
+
+				# after a wrap, everything ahead only depends on the speed pair
+				state = speed
+				if speed[0] != 0:
+					if state in wrap_states:
+						wrap = wrap_states[state]
+						analysis.cycle_start = analysis.wrap_ticks[wrap]
+						analysis.cycle_wrap  = wrap
+						analysis.cycle_ticks = tick - analysis.wrap_ticks[wrap]
+						analysis.cycle_wraps = len(analysis.wrap_ticks)-1 - wrap
+						break
+					wrap_states[state] = len(analysis.wrap_ticks)-1
+
+				if len(analysis.wrap_ticks) > max_wraps:
+					raise Exception("Song timing didn't settle after {} loops".format(max_wraps))
+
+		if speed[0] == 0:
+			# a speed of 0 is how GAX ends a song
+			analysis.is_one_shot = True
+			analysis.end_tick    = tick + 1
+			break
+
+		tick += speed[0]
+
+	if not analysis.is_one_shot and len(analysis.wrap_ticks) > 1:
+		analysis.loop_ticks = analysis.wrap_ticks[1] - analysis.wrap_ticks[0]
+
+	return analysis
+
+
+def analyze_song(gax_obj, song_idx=0):
+
+	'''
+	Analyzes one song of a GAX module without rendering it. See song_analysis.
+	'''
+
+	song_data = gax_obj.get_song_data(song_idx)
+	timeline  = song_timeline(song_data)
+	return analyze_timeline(timeline, song_data.get_properties().restart_position)
@@ -0,0 +1,115 @@
+'''
+Audio-rate kernels for the per-sample (python) engine.
+The channel works out everything that only changes at tick rate first (step rates,
+the envelope, slides, the volume per sample), then hands plain numbers and lists to
+these functions. They don't touch any channel state, so they're easy to swap for
+vectorized or JIT-compiled versions.
+'''
+
+
+def render_wave_positions(position, direction, step_rate, sample_count, wave_length,
+	upper_bound, lower_bound, loop_length, ping_pong, play_once):
+
+	'''
+	Steps the wave position through one tick, with looping and clamping.
+	Returns (read positions, position, direction).
+	'''
+
+	positions = list()
+
+	if wave_length <= 0:
+		# don't attempt to read from an empty sample
+		return [0] * sample_count, 0, direction
+
+	for i in range(sample_count):
+
+		position += step_rate*direction
+
+		if not play_once:
+
+			# looping handlers
+			if position > upper_bound:
+				if ping_pong:
+					# bidi loop
+					direction = -1
+				else:
+					# forward loop
+					# adapted from https://github.com/Prezzodaman/pymod
+					position -= loop_length
+
+			if position <= lower_bound:
+				if ping_pong:
+					# return from backwards reading
+					direction = 1
+
+		if position >= wave_length:
+			position = wave_length - 1
+		elif position < 0:
+			position = 0
+
+		positions.append(position)
+
+	return positions, position, direction
+
+
+def render_modulator_positions(subposition, modulate_position, start_position, step_rate, size,
+	sample_count, wave_length, loop_start, loop_end, direction, play_once):
+
+	'''
+	Steps the wavetable modulator through one tick.
+	Returns (read positions, subposition, final position, modulate position, direction);
+	the final position is None on an empty tick.
+	'''
+
+	positions = list()
+	final_pos = None
+
+	for i in range(sample_count):
+
+		subposition += step_rate
+		subposition %= size
+
+		final_pos = (modulate_position + subposition) + start_position
+
+		if wave_length > 0:
+			if not play_once:
+				if final_pos > loop_end-1:
+					direction = -1
+				if final_pos < loop_start:
+					direction = 1
+		else:
+			# don't attempt to read from an empty sample
+			modulate_position = 0
+
+		positions.append(final_pos)
+
+	return positions, subposition, final_pos, modulate_position, direction
+
+
+def render_output(wave, positions, wave_output, gains, mix_gain, read, hold_bad_reads):
+
+	'''
+	Reads the waveform and applies the per-sample volume and the channel gain.
+	Without read (sample #0) or on a bad read with hold_bad_reads, the previous
+	output is held and keeps getting scaled.
+	Returns (output buffer, last output).
+	'''
+
+	output = list()
+
+	for i in range(len(gains)):
+
+		if read:
+			if not hold_bad_reads:
+				wave_output = wave[int(positions[i])]
+			else:
+				try:
+					wave_output = wave[int(positions[i])]
+				except:
+					pass
+
+		wave_output *= gains[i]
+		wave_output *= mix_gain
+		output.append(wave_output)
+
+	return output, wave_output
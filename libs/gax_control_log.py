@@ -0,0 +1,223 @@
+from .gax_replayer import replayer
+from .gax_render   import offline_renderer, tick_channel
+from .calc_mem     import refresh_rate
+
+import sys
+import array
+import struct
+
+'''
+Control logs: render one song at several mixing rates from a single control pass.
+The sequencer (row timing, speed modulation, pattern breaks, the order list) and the perf lists
+don't depend on the mixing rate, so they're run once and recorded as a small binary log: for every
+tick, the speed, the row that gets read and what each channel's perf list put out (pitch, volume,
+fixed pitch, waveform, wave params and wave position resets). The audio stage then plays the
+channels from the log at any rate without running either, sample-identical to a direct render at
+that rate.
+
+The rows still get applied to the channels in the audio stage (read_row): this replayer runs the
+slides and the envelope once per output sample, and the slid pitch feeds back into the next note's
+tone portamento, so what a note does to a channel depends on the mixing rate. The same goes for the
+modulator and vibrato, which run with the audio.
+'''
+
+
+log_header   = struct.Struct("<4sHHHBBHII") # magic, format version, song, loops, GAX version, channels, ticks, perf states
+log_magic    = b"GAXL"
+log_version  = 2
+
+# perf_semitone, perf_row_volume, is_fixed, wave_idx, wave params (instrument, slot), wave position reset
+perf_state_struct = struct.Struct("<dhBHhhB")
+
+
+def get_wave_param_refs(instruments):
+
+	# every wave params object in a compiled bank -> (instrument, slot), keyed on the
+	# objects themselves, which the bank keeps alive
+	refs = {id(None): (-1, -1)}
+
+	for instr_idx, instrument in enumerate(instruments):
+		for slot, wave_params in enumerate(instrument.wave_params):
+			if wave_params != None:
+				refs.setdefault(id(wave_params), (instr_idx, slot))
+
+	return refs
+
+
+class control_log:
+
+	'''
+	One song's control stream, tick by tick.
+
+	speeds: the replayer's speed pair while the channels tick, two bytes per tick
+	rows:   row read at the end of each tick (position*step_count + step), -1 for none
+	channel_states: per tick, an index into perf_states for every music channel, -1 without an instrument
+	perf_states: every distinct perf list output, as in perf_state_struct
+	'''
+
+	def __init__(self, song_idx=0, loops=1, version=(3,5), channel_count=0):
+
+		self.song_idx      = song_idx
+		self.loops         = loops
+		self.version       = version
+		self.channel_count = channel_count
+
+		self.speeds         = array.array('B')
+		self.rows           = array.array('i')
+		self.channel_states = array.array('i')
+		self.perf_states    = list()
+
+
+	def __len__(self):
+		return len(self.rows)
+
+
+	def get_perf_states(self, instruments):
+
+		'''
+		The perf states as channel.set_perf_state takes them, with the wave params
+		looked up in a compiled instrument bank of the same module.
+		'''
+
+		perf_states = list()
+
+		for perf_semitone, volume, is_fixed, wave_idx, instr_idx, slot, reset in self.perf_states:
+			wave_params = instruments[instr_idx].wave_params[slot] if instr_idx >= 0 else None
+			perf_states.append((perf_semitone, volume, bool(is_fixed), wave_idx, wave_params, bool(reset)))
+
+		return perf_states
+
+
+	def to_bytes(self):
+
+		rows           = array.array('i', self.rows)
+		channel_states = array.array('i', self.channel_states)
+		if sys.byteorder == "big":
+			rows.byteswap() # stored little endian
+			channel_states.byteswap()
+
+		header = log_header.pack(log_magic, log_version, self.song_idx, self.loops, self.version[0], self.version[1],
+			self.channel_count, len(self.rows), len(self.perf_states))
+
+		return (header + b''.join(perf_state_struct.pack(*perf_state) for perf_state in self.perf_states)
+				+ self.speeds.tobytes() + rows.tobytes() + channel_states.tobytes())
+
+
+	@classmethod
+	def from_bytes(cls, data):
+
+		(magic, version, song_idx, loops, major_version, minor_version,
+		 channel_count, tick_count, state_count) = log_header.unpack_from(data)
+		if magic != log_magic or version != log_version:
+			raise ValueError("Not a GAX control log")
+
+		log = cls(song_idx, loops, (major_version, minor_version), channel_count)
+
+		offset = log_header.size
+		if len(data) < offset + state_count*perf_state_struct.size:
+			raise ValueError("The control log is cut short")
+		log.perf_states = [perf_state_struct.unpack_from(data, offset + i*perf_state_struct.size)
+						   for i in range(state_count)]
+		offset += state_count*perf_state_struct.size
+
+		log.speeds.frombytes(data[offset:offset + tick_count*2])
+		offset += tick_count*2
+		log.rows.frombytes(data[offset:offset + tick_count*log.rows.itemsize])
+		offset += tick_count*log.rows.itemsize
+		log.channel_states.frombytes(data[offset:offset + tick_count*channel_count*log.channel_states.itemsize])
+		if sys.byteorder == "big":
+			log.rows.byteswap()
+			log.channel_states.byteswap()
+
+		if (len(log.speeds) != tick_count*2 or len(log.rows) != tick_count
+			or len(log.channel_states) != tick_count*channel_count):
+			raise ValueError("The control log is cut short")
+
+		return log
+
+
+def record_control_log(gax_obj, song_idx=0, loops=1, version=(3,5)):
+
+	'''
+	Runs the sequencer and the perf lists through a song (for the same number of ticks
+	render_ticks(loops) would produce) and returns its control_log. No audio gets rendered.
+	'''
+
+	replayer_obj = replayer(gax_obj, song_idx=song_idx)
+	major_version, minor_version = version
+
+	log = control_log(song_idx, loops, version, replayer_obj.num_channels)
+
+	wave_param_refs = get_wave_param_refs(replayer_obj.instruments)
+	state_indices   = dict() # perf state -> index into log.perf_states
+
+	while replayer_obj.speed[0] != 0:
+
+		log.speeds.extend(replayer_obj.speed)
+
+		for ch in range(replayer_obj.num_channels):
+			perf_state = replayer_obj.channels[ch].tick_control(ch, replayer_obj,
+				replayer_obj.instruments, replayer_obj.sample_bank, major_version, minor_version)
+
+			if perf_state == None:
+				log.channel_states.append(-1)
+				continue
+
+			perf_semitone, volume, is_fixed, wave_idx, wave_params, reset = perf_state
+			perf_state = (perf_semitone, volume, int(is_fixed), wave_idx) + wave_param_refs[id(wave_params)] + (int(reset),)
+
+			state_idx = state_indices.get(perf_state)
+			if state_idx == None:
+				state_idx = state_indices[perf_state] = len(log.perf_states)
+				log.perf_states.append(perf_state)
+			log.channel_states.append(state_idx)
+
+		if replayer_obj.speed_timer <= 0:
+			log.rows.append(replayer_obj.cur_pat*replayer_obj.step_count + replayer_obj.cur_step)
+		else:
+			log.rows.append(-1)
+
+		replayer_obj.tick_sequencer()
+
+		if replayer_obj.loop_count >= loops+1:
+			break
+
+	return log
+
+
+def render_control_log(log, gax_obj, rate=0, fps=refresh_rate, engine=None, output_format="int8"):
+
+	'''
+	The audio stage: generator that yields one tick of PCM at a time, like
+	offline_renderer.render_ticks, with the rows, speeds and perf lists taken from the log.
+	'''
+
+	renderer = offline_renderer(gax_obj, log.song_idx, rate=rate, version=log.version, fps=fps, engine=engine,
+		output_format=output_format)
+	replayer_obj = renderer.vars
+
+	if replayer_obj.num_channels != log.channel_count:
+		raise ValueError("The control log has {} channels, but the song has {}".format(log.channel_count, replayer_obj.num_channels))
+
+	perf_states   = log.get_perf_states(replayer_obj.instruments)
+	step_count    = replayer_obj.step_count
+	channel_count = log.channel_count
+
+	for tick in range(len(log)):
+
+		replayer_obj.speed = [log.speeds[tick*2], log.speeds[tick*2 + 1]]
+
+		for ch in range(channel_count):
+			state_idx = log.channel_states[tick*channel_count + ch]
+			tick_channel(replayer_obj, ch, renderer.mixing_rate, renderer.fps,
+				gain=renderer.gain,
+				major_version=renderer.maj_version,
+				minor_version=renderer.min_version,
+				perf_state=perf_states[state_idx] if state_idx >= 0 else None)
+
+		replayer_obj.timer += 1
+		row = log.rows[tick]
+		if row >= 0:
+			replayer_obj.read_row(row // step_count, row % step_count)
+
+		yield replayer_obj.mix_tick(None, debug=True, export=True)
@@ -0,0 +1,217 @@
+'''
+Volume envelopes.
+The envelope state machine (tick_volenv) runs once per output sample in the replayer,
+but it only ever moves at tick rate: inside one tick it settles after a call or two,
+and every call after that is a no-op. So instead of running it per sample, each
+instrument gets a table of what one whole tick does to the envelope, built from the
+state machine itself (kludges and all) the first time a state comes up.
+'''
+
+
+keep = None # table entries that leave a value as it was
+
+
+def calc_volenv_lerp(self):
+	try:
+		volenv_a = self.volenv_buffer[self.volenv_idx]
+		volenv_b = self.volenv_buffer[self.volenv_idx-1]
+		self.volenv_lerp = ((volenv_b[1]-volenv_a[1])/(volenv_b[0]-volenv_a[0]))
+	except:
+		self.volenv_lerp = 0
+
+
+def tick_volenv(self):
+
+	# one step of the envelope; used as a channel method and to build the tables below
+
+	if len(self.volenv_buffer) > 1: # only read in volenv if there is any data
+
+		if not self.volenv_turning_off:
+			self.volenv_loop = self.instrument_data.volenv_has_loop
+								# detect when it's appropriate to loop our volume envelope
+		else:
+			self.volenv_loop = False
+
+		# shifts the envelope over 1 tick forward.
+		# this fixes envelope sidechains in Iridion II / 3D and Jackie Chan Adventures
+		kludge = 1 if self.volenv_idx else 0
+
+		if self.timer == self.volenv_buffer[self.volenv_idx][0] + kludge:
+			self.volenv_has_looped = False
+
+			# if our timer matches the current envelope point's time (X),
+			# we increment the volenv_idx variable by 1 and set the appropriate volume
+
+			if not self.volenv_pause:
+				self.volenv_cur_vol = self.volenv_buffer[self.volenv_idx][1]
+				self.volenv_idx += 1
+
+			if not self.volenv_loop:
+				if self.volenv_idx >= self.instrument_data.volenv_point_count:
+					self.volenv_idx = 0
+					self.volenv_lerp = 0
+					self.volenv_end = True
+					self.is_active = False
+
+			if self.volenv_loop:
+				if self.volenv_idx > self.instrument_data.volenv_loop_end:
+					self.volenv_idx = self.instrument_data.volenv_loop_start
+					self.timer = self.volenv_buffer[self.volenv_idx][0] # extremely shit solution but it works
+					self.volenv_has_looped = True
+
+
+	else:
+		# no volume envelope here
+		self.volenv_cur_vol = self.volenv_buffer[self.volenv_idx][1]
+		self.volenv_lerp = 0
+
+
+	# envelope lerping
+
+	if len(self.volenv_buffer) > 1:
+
+		if not self.volenv_end:
+			# prevent the sample from getting louder and scaring the elderly
+			if not self.volenv_pause:
+				self.calc_volenv_lerp()
+		else:
+			# fixes instrument #24 in SpongeBob SquarePants: Battle for Bikini Bottom
+			self.volenv_turning_off = False
+
+
+		# sustain point handler
+		if self.volenv_idx-1 == self.volenv_pause_point: # when we reach the sustain point
+			self.volenv_pause = True
+			self.volenv_lerp = 0 # *stop* on the sustain point
+
+		# sustain / pause handling
+
+		if not self.volenv_pause:
+			self.volenv_timer += 1
+
+		if self.volenv_pause_point != None: # if there even exists a sustain point:
+			if self.volenv_note_off == True:
+				# reset to where we were before the sustain pause
+				self.volenv_pause = False
+				self.volenv_idx = self.volenv_pause_point
+				self.timer = self.volenv_buffer[self.volenv_pause_point][0]
+				self.volenv_pause_point = None
+				self.volenv_note_off = False
+				self.volenv_turning_off = True
+
+
+	if self.volenv_pause_point == None and self.volenv_note_off:
+		# fixes a few tracks in Rayman - Raving Rabbids (U)
+		self.volenv_cur_vol = 0
+		self.volenv_lerp = 0
+
+
+class volenv_scratch:
+
+	'''
+	Stand-in for a channel that only has the envelope fields, for running tick_volenv on.
+	'''
+
+	__slots__ = ("timer", "volenv_idx", "volenv_cur_vol", "volenv_lerp", "volenv_timer",
+				 "volenv_pause", "volenv_pause_point", "volenv_note_off", "volenv_turning_off",
+				 "volenv_loop", "volenv_has_looped", "volenv_end", "is_active",
+				 "volenv_buffer", "instrument_data")
+
+	tick_volenv      = tick_volenv
+	calc_volenv_lerp = calc_volenv_lerp
+
+
+class volenv_tick:
+
+	'''
+	What one tick of tick_volenv calls does, starting from one envelope state.
+
+	volumes:      (sample count, volume) runs; a volume of keep holds whatever came before
+	lerp, timer:  the new value, or keep
+	state:        the envelope state the tick ends in
+	volenv_timer: how far volenv_timer moves
+	deactivate:   True if the envelope ended and switched the channel off
+	'''
+
+	__slots__ = ("volumes", "lerp", "timer", "state", "volenv_timer", "deactivate")
+
+
+class volenv_table:
+
+	'''
+	Per-tick envelope table for one compiled instrument.
+	Entries are keyed on (envelope state, samples per tick) and filled in the first
+	time they're needed, by running tick_volenv on a scratch copy until it settles.
+
+	The timer only matters to the envelope when it lines up with a point (+1 for the
+	kludge), so every timer past the last point shares one entry.
+	'''
+
+	def __init__(self, instrument_data):
+
+		self.instrument_data = instrument_data
+		self.points          = instrument_data.volenv_points
+		self.timer_limit     = max([point[0] for point in self.points], default=0) + 2
+		self.ticks           = dict()
+
+
+	def get_state(self, ch):
+
+		# everything tick_volenv reads, except the timer (see get_tick)
+		return (ch.volenv_idx, ch.volenv_pause, ch.volenv_pause_point, ch.volenv_note_off,
+				ch.volenv_turning_off, ch.volenv_loop, ch.volenv_has_looped, ch.volenv_end)
+
+
+	def build_tick(self, timer, state, sample_count):
+
+		scratch = volenv_scratch()
+		scratch.volenv_buffer   = self.points
+		scratch.instrument_data = self.instrument_data
+		scratch.timer           = timer
+		scratch.volenv_timer    = 0
+		scratch.is_active       = True
+		scratch.volenv_lerp     = keep
+
+		(scratch.volenv_idx, scratch.volenv_pause, scratch.volenv_pause_point, scratch.volenv_note_off,
+		 scratch.volenv_turning_off, scratch.volenv_loop, scratch.volenv_has_looped, scratch.volenv_end) = state
+
+		volumes = list()
+		i = 0
+
+		while i < sample_count:
+
+			scratch.volenv_cur_vol = keep
+			old_state    = (scratch.timer,) + self.get_state(scratch)
+			volenv_timer = scratch.volenv_timer
+
+			scratch.tick_volenv()
+			volumes.append([1, scratch.volenv_cur_vol])
+			i += 1
+
+			if (scratch.timer,) + self.get_state(scratch) == old_state:
+				# settled; every call from here on does the same thing again
+				volumes[-1][0]       += sample_count - i
+				scratch.volenv_timer += (scratch.volenv_timer - volenv_timer) * (sample_count - i)
+				break
+
+		tick = volenv_tick()
+		tick.volumes      = [tuple(run) for run in volumes]
+		tick.lerp         = scratch.volenv_lerp
+		tick.timer        = scratch.timer if scratch.timer != timer else keep
+		tick.state        = self.get_state(scratch)
+		tick.volenv_timer = scratch.volenv_timer
+		tick.deactivate   = not scratch.is_active
+		return tick
+
+
+	def get_tick(self, ch, sample_count):
+
+		timer = min(ch.timer, self.timer_limit)
+		key = (timer, self.get_state(ch), sample_count)
+
+		try:
+			return self.ticks[key]
+		except KeyError:
+			tick = self.build_tick(timer, key[1], sample_count)
+			self.ticks[key] = tick
+			return tick
@@ -0,0 +1,194 @@
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+'''
+Audio-rate kernels for the fixed-point engine.
+The GBA has no FPU, so GAX steps through waveforms with integer fixed-point accumulators and
+scales samples with integer multiplies and shifts. These kernels do the same: wave positions and
+step rates are 16.16 fixed point, pitches sit on the 1/32 semitone grid (like perf_pitch), and
+volumes are 8-bit integers. Everything is exact integer math on int64 arrays, so a run of
+positions is just start + step*n; no left-to-right float sums needed.
+
+Like gax_audio, these don't touch any channel state.
+'''
+
+
+fixed_bits = 16
+fixed_one  = 1 << fixed_bits
+
+
+def to_fixed(value):
+	return int(round(value * fixed_one))
+
+
+def wrap_fixed_position(position, direction, wave_end, upper_bound, lower_bound, loop_length,
+	ping_pong, play_once):
+
+	# the looping / clamping of one sample, same rules as render_wave_positions
+
+	if not play_once:
+
+		if position > upper_bound:
+			if ping_pong:
+				direction = -1
+			else:
+				position -= loop_length
+
+		if position <= lower_bound:
+			if ping_pong:
+				direction = 1
+
+	if position >= wave_end:
+		position = wave_end - fixed_one
+	elif position < 0:
+		position = 0
+
+	return position, direction
+
+
+def render_fixed_positions(position, direction, step_rate, sample_count, wave_length,
+	upper_bound, lower_bound, loop_length, ping_pong, play_once):
+
+	'''
+	Steps a 16.16 wave position through one tick, with looping and clamping.
+	The bounds are in samples. Returns (read positions, position, direction).
+	'''
+
+	wave_end    = wave_length * fixed_one
+	upper_bound = upper_bound * fixed_one
+	lower_bound = lower_bound * fixed_one
+	loop_length = loop_length * fixed_one
+
+	# a forward loop that stays clear of the end of the sample is plain modulo arithmetic
+	# once the position is inside it: every step past the upper bound lands in [loop_base, upper_bound]
+	loop_base = upper_bound - loop_length + 1
+	is_modulo = (not play_once and not ping_pong and 0 < step_rate <= loop_length
+				 and upper_bound < wave_end and loop_base >= 0)
+
+	positions  = np.empty(sample_count, dtype=np.int64)
+	directions = np.empty(sample_count, dtype=np.int8)
+	seen       = dict() # position + direction after each wrap, to spot cycles
+	scalar_run = 0
+	i = 0
+
+	while i < sample_count:
+
+		if is_modulo and direction == 1 and loop_base <= position <= upper_bound:
+			run = (position - loop_base + step_rate * np.arange(1, sample_count-i + 1, dtype=np.int64)) % loop_length
+			positions[i:]  = run + loop_base
+			directions[i:] = direction
+			position = int(positions[-1])
+			break
+
+		if scalar_run:
+			# the wraps are too close together for numpy to pay off
+			end = min(i+scalar_run, sample_count)
+			while i < end:
+				position, direction = wrap_fixed_position(position + step_rate*direction, direction, wave_end,
+					upper_bound, lower_bound, loop_length, ping_pong, play_once)
+				positions[i]  = position
+				directions[i] = direction
+				i += 1
+			scalar_run = 0
+			continue
+
+		run = position + (step_rate*direction) * np.arange(1, sample_count-i + 1, dtype=np.int64)
+
+		events = (run >= wave_end) | (run < 0)
+		if not play_once:
+			if not ping_pong or direction != -1:
+				events |= run > upper_bound
+			if ping_pong and direction != 1:
+				events |= run <= lower_bound
+
+		hits = np.flatnonzero(events)
+		if not hits.size:
+			positions[i:]  = run
+			directions[i:] = direction
+			position = int(run[-1])
+			break
+
+		k = hits[0]
+		positions[i:i+k]  = run[:k]
+		directions[i:i+k] = direction
+
+		position, direction = wrap_fixed_position(int(run[k]), direction, wave_end,
+			upper_bound, lower_bound, loop_length, ping_pong, play_once)
+		positions[i+k]  = position
+		directions[i+k] = direction
+		i += k+1
+
+		state = (position, direction)
+		if state in seen:
+			# back where an earlier wrap left us (e.g. parked on the last byte of a one-shot),
+			# so the rest of the tick repeats that stretch
+			period  = i - seen[state]
+			repeats = -(-(sample_count-i) // period)
+			positions[i:]  = np.tile(positions[i-period:i], repeats)[:sample_count-i]
+			directions[i:] = np.tile(directions[i-period:i], repeats)[:sample_count-i]
+			position  = int(positions[-1])
+			direction = int(directions[-1])
+			break
+		seen[state] = i
+
+		if k < 8:
+			scalar_run = 64
+
+	return positions, position, direction
+
+
+def render_fixed_modulator(subposition, modulate_position, start_position, step_rate, size,
+	sample_count, loop_start, loop_end, direction, play_once):
+
+	'''
+	Steps the wavetable modulator through one tick. subposition and step_rate are 16.16,
+	the rest is in samples. Returns (read positions, subposition, direction).
+	'''
+
+	size = size * fixed_one
+
+	subpositions = (subposition + step_rate * np.arange(1, sample_count+1, dtype=np.int64)) % size
+	positions    = subpositions + (modulate_position + start_position) * fixed_one
+
+	if not play_once:
+		backwards = positions > (loop_end-1) * fixed_one
+		forwards  = positions < loop_start * fixed_one
+		turns = np.flatnonzero(backwards | forwards)
+		if turns.size:
+			direction = 1 if forwards[turns[-1]] else -1
+
+	return positions, int(subpositions[-1]), direction
+
+
+def get_fixed_volumes(row_volume, step_volumes, env_volumes):
+
+	# 8-bit volume per sample: the three volumes multiplied and shifted back down
+	return (int(row_volume) * step_volumes.astype(np.int64) * env_volumes.astype(np.int64)) >> 16
+
+
+def render_fixed_output(samples, valid, volumes, mix_gain, wave_output):
+
+	'''
+	Scales the samples that were read by the per-sample volume and the 8.8 channel gain.
+	valid says which samples actually got read (None: none of them); the others hold and
+	keep scaling the previous output, like render_output.
+	Returns (output buffer, last output).
+	'''
+
+	factors = volumes * mix_gain
+
+	if valid is not None and valid.all():
+		output = (samples * factors) >> 16
+		return output, int(output[-1])
+
+	# every sample depends on the one before it
+	output = np.empty(len(factors), dtype=np.int64)
+	for i in range(len(factors)):
+		if valid is not None and valid[i]:
+			wave_output = int(samples[i])
+		wave_output = (wave_output * int(factors[i])) >> 16
+		output[i] = wave_output
+
+	return output, wave_output
@@ -0,0 +1,223 @@
+'''
+Compiled instruments for the replayer.
+shinen_gax.instrument keeps everything in nested dicts, which is what the packer and the
+editors want. The replayer reads the same fields every tick (and some every sample),
+so each instrument is compiled once into flat, read-only objects with the derived
+flags already worked out.
+'''
+
+from .gax_enums    import perf_row_effect
+from .gax_envelope import volenv_table
+
+
+class program:
+
+	'''
+	Base for the compiled objects: fixed slots, and read-only once built.
+	'''
+
+	__slots__ = ()
+
+	def set_fields(self, **fields):
+		for name, value in fields.items():
+			object.__setattr__(self, name, value)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("compiled instrument data is read-only; recompile the instrument instead")
+
+
+class wave_program(program):
+
+	'''
+	One wave slot's wave params.
+	'''
+
+	__slots__ = ("finetune", "finetune_semitones", "modulate", "ping_pong",
+				 "start_position", "loop_start", "loop_end",
+				 "modulate_size", "modulate_step", "modulate_speed",
+				 "play_once", "is_invalid_loop", "is_modulate")
+
+	def __init__(self, wave_params):
+
+		is_invalid_loop = (wave_params["loop_end"] - wave_params["loop_start"] < 0)
+
+		self.set_fields(
+			finetune           = wave_params["finetune"],
+			finetune_semitones = wave_params["finetune"]/32,
+			modulate           = wave_params["modulate"],
+			ping_pong          = wave_params["ping_pong"],
+			start_position     = wave_params["start_position"],
+			loop_start         = wave_params["loop_start"],
+			loop_end           = wave_params["loop_end"],
+			modulate_size      = wave_params["modulate_size"],
+			modulate_step      = wave_params["modulate_step"],
+			modulate_speed     = wave_params["modulate_speed"],
+
+			# loop outcome from the loop points
+			play_once       = (wave_params["loop_end"] == 0 and wave_params["loop_start"] == 0),
+			is_invalid_loop = is_invalid_loop,
+			is_modulate     = bool(wave_params["modulate"] and not is_invalid_loop
+								   and wave_params["modulate_speed"] > 0)
+		)
+
+
+## perf list opcodes
+# every effect column is compiled down to one of these, with the param already signed.
+# columns that do nothing (no effect / invalid effects) are dropped
+
+op_pitch_slide  = 0 # perf_note_slide_amount = param
+op_volume_slide = 1 # perf_vol_slide_amount = param
+op_jump         = 2 # jump to row param
+op_jump_delay   = 3 # jump to row param (the delay isn't emulated, see run_perf_row)
+op_set_volume   = 4
+op_set_speed    = 5
+
+effect_opcodes = {
+	perf_row_effect.pitch_slide_up:    (op_pitch_slide, 1),
+	perf_row_effect.pitch_slide_down:  (op_pitch_slide, -1),
+	perf_row_effect.jump_to_row:       (op_jump, 1),
+	perf_row_effect.jump_delay:        (op_jump_delay, 1),
+	perf_row_effect.volume_slide_up:   (op_volume_slide, 1),
+	perf_row_effect.volume_slide_down: (op_volume_slide, -1),
+	perf_row_effect.set_volume:        (op_set_volume, 1),
+	perf_row_effect.set_speed:         (op_set_speed, 1)
+}
+
+
+class perf_row_program(program):
+
+	'''
+	One perf list row, with its wave slot already looked up in the instrument.
+
+	note_semitone:  the perf semitone the note sets (note correction applied)
+	sets_wave:      the row switches waveforms (has a note and a wave slot)
+	wave_idx:       the waveform it switches to; None if the slot doesn't exist
+	has_wave_params / wave_params: the slot's wave params, if the instrument has any for it
+	ops:            (opcode, param) pairs in column order
+	'''
+
+	__slots__ = ("note", "has_note", "fixed", "note_semitone", "wave_slot_id",
+				 "sets_wave", "wave_idx", "has_wave_params", "wave_params", "ops")
+
+	def __init__(self, perf_row, wave_slots=(), wave_params=()):
+
+		has_note = perf_row["note"] not in [0, None]
+		slot_idx = perf_row["wave_slot_id"] - 1
+		sets_wave = perf_row["wave_slot_id"] > 0 and has_note
+
+		ops = list()
+		for param, effect in perf_row["effect"]:
+			if effect in effect_opcodes:
+				opcode, sign = effect_opcodes[effect]
+				ops.append((opcode, param * sign))
+
+		self.set_fields(
+			note          = perf_row["note"],
+			has_note      = has_note,
+			fixed         = bool(perf_row["fixed"]),
+			note_semitone = (perf_row["note"] - 2 if perf_row["fixed"] else perf_row["note"] - 4) if has_note else None,
+			wave_slot_id  = perf_row["wave_slot_id"],
+
+			sets_wave       = sets_wave,
+			wave_idx        = wave_slots[slot_idx] if sets_wave and slot_idx < len(wave_slots) else None,
+			has_wave_params = sets_wave and slot_idx < len(wave_params),
+			wave_params     = wave_params[slot_idx] if sets_wave and slot_idx < len(wave_params) else None,
+
+			ops = tuple(ops)
+		)
+
+
+class instrument_program(program):
+
+	'''
+	Everything the replayer needs from one instrument.
+	wave_params lines up with wave_slots like in the source instrument (None for unused slots).
+	'''
+
+	__slots__ = ("is_null", "wave_slots", "wave_params",
+				 "use_vibrato", "vibrato_wait", "vibrato_depth", "vibrato_speed",
+				 "perf_row_speed", "perf_rows",
+				 "volenv_points", "volenv_point_count", "volenv_sustain_point",
+				 "volenv_loop_start", "volenv_loop_end", "volenv_has_loop", "volenv_table")
+
+	def __init__(self, instrument):
+
+		vibrato_params  = instrument.header["vibrato_params"]
+		volume_envelope = instrument.volume_envelope
+
+		wave_slots  = tuple(instrument.header["wave_slots"])
+		wave_params = tuple(None if wave_params == None else wave_program(wave_params)
+							for wave_params in instrument.wave_params)
+
+		self.set_fields(
+			is_null     = instrument.header["is_null"],
+			wave_slots  = wave_slots,
+			wave_params = wave_params,
+
+			use_vibrato   = not (vibrato_params["vibrato_wait"] == 0 and vibrato_params["vibrato_depth"] == 0
+								 and vibrato_params["vibrato_speed"] == 0),
+			vibrato_wait  = vibrato_params["vibrato_wait"],
+			vibrato_depth = vibrato_params["vibrato_depth"],
+			vibrato_speed = vibrato_params["vibrato_speed"],
+
+			perf_row_speed = instrument.perf_list["perf_row_speed"],
+			perf_rows      = tuple(perf_row_program(perf_row, wave_slots, wave_params)
+								   for perf_row in instrument.perf_list["perf_list_data"]),
+
+			volenv_points        = tuple(tuple(point) for point in volume_envelope["points"]),
+			volenv_point_count   = len(volume_envelope["points"]),
+			volenv_sustain_point = volume_envelope.get("sustain_point"),
+			volenv_loop_start    = volume_envelope["loop_start"],
+			volenv_loop_end      = volume_envelope["loop_end"],
+			volenv_has_loop      = (volume_envelope["loop_start"] != None and volume_envelope["loop_end"] != None)
+		)
+
+		# filled in as the envelope gets played; see gax_envelope
+		self.set_fields(volenv_table=volenv_table(self))
+
+
+class instrument_bank:
+
+	'''
+	A whole instrument set, compiled. Indexes like the source instrument_set.
+	Build it once per instrument set (the replayer does this) and rebuild it after
+	editing any of the instruments.
+	'''
+
+	def __init__(self, instrument_set):
+		self.programs = [instrument_program(instrument) for instrument in instrument_set]
+
+	def __len__(self):
+		return len(self.programs)
+
+	def __getitem__(self, idx):
+		return self.programs[idx]
+
+	def __iter__(self):
+		return iter(self.programs)
+
+
+def get_instrument_bank(instrument_set, replayer=None):
+
+	'''
+	Returns a compiled instrument bank for a raw instrument set, for callers that still pass the raw set around.
+	If it's one of replayer's own instrument sets, that's the bank the replayer already compiled;
+	any other set gets compiled once and kept on the replayer, so it lives as long as the replayer does.
+	Without a replayer, it compiles the set every call.
+	'''
+
+	if replayer == None:
+		return instrument_bank(instrument_set)
+
+	if instrument_set is replayer.gax_data.instrument_set:
+		return replayer.instruments
+	if replayer.fx_instruments != None and instrument_set is replayer.fx_data.instrument_set:
+		return replayer.fx_instruments
+
+	# keyed on the set itself, which is kept alive alongside its bank
+	try:
+		return replayer.foreign_instruments[id(instrument_set)][1]
+	except KeyError:
+		bank = instrument_bank(instrument_set)
+		replayer.foreign_instruments[id(instrument_set)] = (instrument_set, bank)
+		return bank
@@ -0,0 +1,161 @@
+from .gax_render   import offline_renderer, tick_channel
+from .gax_replayer import quantize
+from .calc_mem     import refresh_rate
+
+import os
+import tempfile
+import concurrent.futures
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+'''
+Renders one song on several cores at once.
+The channels of a song don't affect each other: each one only depends on its own state and
+on the sequencer, which doesn't depend on any channel. So every music channel is rendered in
+its own process (each running its own copy of the sequencer), and the channel outputs are
+mixed afterwards exactly like the replayer mixes them. The result is sample-identical to
+offline_renderer.render_ticks.
+
+One channel is the smallest piece of work, so the speedup is capped at the song's channel
+count (a 4 channel song gains nothing past 4 cores), and the busiest channel sets the pace.
+FX channels aren't rendered here, only the music channels.
+'''
+
+
+def get_channel_key(replayer_obj, ch):
+	# everything one channel's audio depends on from here on: the sequencer and the channel itself
+	return (tuple(replayer_obj.speed), replayer_obj.speed_timer, replayer_obj.cur_step, replayer_obj.cur_pat,
+			replayer_obj.skip, replayer_obj.cur_step_data[ch],
+			replayer_obj.channels[ch].get_key(replayer_obj.get_channel_bank(ch)))
+
+
+def render_channel(job, max_cached_loops=8):
+
+	'''
+	Runs in a worker process. Renders every tick of one channel and writes the
+	unquantized output to job["path"] as float64. Returns the length of every tick.
+
+	Like offline_renderer.render_ticks(reuse_loops=True), once the channel is back in a state
+	it had at an earlier loop point the rest is copied from the file instead of rendered.
+	'''
+
+	renderer = offline_renderer(job["module"], job["song_idx"], rate=job["rate"],
+		version=job["version"], fps=job["fps"], engine=job["engine"])
+	replayer_obj = renderer.vars
+	ch = job["channel"]
+
+	lengths   = list()
+	wrap_keys = dict() # channel state at a loop point -> index into wraps
+	wraps     = list() # (tick count, file offset) at every loop point kept
+	caching   = job["loops"] > 1
+
+	with open(job["path"], "w+b") as f:
+
+		while replayer_obj.speed[0] != 0:
+
+			loop_count = replayer_obj.loop_count
+
+			tick_channel(replayer_obj, ch, renderer.mixing_rate, renderer.fps,
+				gain=renderer.gain, major_version=renderer.maj_version, minor_version=renderer.min_version)
+			replayer_obj.tick_sequencer()
+
+			output = replayer_obj.channels[ch].output_buffer
+			f.write(np.asarray(output, dtype=np.float64).tobytes())
+			lengths.append(len(output))
+
+			if replayer_obj.loop_count >= job["loops"]+1:
+				return lengths
+
+			if not caching or replayer_obj.loop_count == loop_count:
+				continue
+
+			try:
+				key = get_channel_key(replayer_obj, ch)
+				hash(key)
+			except TypeError:
+				key = None # something unhashable in there; just render everything
+
+			if key in wrap_keys:
+				break
+
+			if key == None or len(wraps) >= max_cached_loops:
+				caching = False # never settles
+				continue
+
+			wrap_keys[key] = len(wraps)
+			wraps.append((len(lengths), f.tell()))
+
+		else:
+			return lengths # the song ended
+
+		# from the matching loop point on, the channel repeats itself; one loop at a time
+		cycle = wraps[wrap_keys[key]:] + [(len(lengths), f.tell())]
+		loop_count = replayer_obj.loop_count
+
+		while True:
+			for (start_tick, start_offset), (end_tick, end_offset) in zip(cycle, cycle[1:]):
+				f.seek(start_offset)
+				data = f.read(end_offset - start_offset)
+				f.seek(0, os.SEEK_END)
+				f.write(data)
+				lengths.extend(lengths[start_tick:end_tick])
+
+				loop_count += 1
+				if loop_count >= job["loops"]+1:
+					return lengths
+
+
+def render_parallel(module, song_idx=0, loops=1, rate=0, version=(3,5), fps=refresh_rate,
+	engine=None, jobs=None, output_format="int8"):
+
+	'''
+	Generator like offline_renderer.render_ticks (one tick of PCM in output_format at a time),
+	but the channels get rendered in parallel first. Needs NumPy.
+
+	jobs: number of worker processes, every core by default. More than one per music channel doesn't help
+	'''
+
+	if np == None:
+		raise Exception("Parallel rendering requires NumPy to be installed")
+
+	channel_count = module.get_song_data(song_idx).get_properties().channel_count
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		channel_jobs = [{
+			"module": module,
+			"song_idx": song_idx,
+			"loops": loops,
+			"rate": rate,
+			"version": version,
+			"fps": fps,
+			"engine": engine,
+			"channel": ch,
+			"path": os.path.join(temp_dir, "ch{:0>2}.raw".format(ch))
+		} for ch in range(channel_count)]
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+			tick_lengths = list(pool.map(render_channel, channel_jobs))
+
+		outputs = [np.memmap(job["path"], dtype=np.float64, mode="r") if os.path.getsize(job["path"]) else np.zeros(0)
+				   for job in channel_jobs]
+		offsets = [0] * channel_count
+
+		# mix tick by tick, same as replayer.mix_channels
+		for tick in range(len(tick_lengths[0])):
+
+			sample_count = tick_lengths[0][tick]
+			mix_buffer = np.zeros(sample_count)
+
+			for ch in range(channel_count):
+				length = tick_lengths[ch][tick]
+				used   = min(length, sample_count)
+				mix_buffer[:used] += outputs[ch][offsets[ch]:offsets[ch]+used]
+				offsets[ch] += length
+
+			yield quantize(mix_buffer, sample_count, output_format)
+
+		del outputs # let go of the memory maps before the folder gets removed
@@ -0,0 +1,70 @@
+from .general import get_period, get_freq
+from .gax_fixed import to_fixed
+
+'''
+GAX pitches are quantized to 1/32 of a semitone (see perf_pitch in the replayer),
+so the step rate of every pitch the sequencer can land on is worked out ahead of time.
+'''
+
+min_pitch = -128 * 32 # in 1/32 semitones
+max_pitch =  256 * 32
+
+
+class pitch_table:
+
+	'''
+	Step rates (samples per output sample) for every 1/32 semitone pitch.
+	One table is built per mixing rate, the first time it's asked for.
+	Meant to be built once per replayer and shared by all of its channels.
+	'''
+
+	def __init__(self):
+		self.tables       = dict()
+		self.fixed_tables = dict()
+
+
+	def build_table(self, mix_rate):
+		# pitch/32 is the exact float the replayer ends up with on a grid pitch,
+		# so these are bit-identical to calling get_freq(get_period()) directly
+		table = [get_freq(get_period(pitch/32)) / mix_rate for pitch in range(min_pitch, max_pitch)]
+		self.tables[mix_rate] = table
+		return table
+
+
+	def get_step_rate(self, semitone, mix_rate):
+
+		try:
+			table = self.tables[mix_rate]
+		except KeyError:
+			table = self.build_table(mix_rate)
+
+		fine_pitch = semitone*32
+		pitch = int(fine_pitch)
+
+		if pitch == fine_pitch and min_pitch <= pitch < max_pitch:
+			return table[pitch - min_pitch]
+
+		# off the grid (vibrato, a slide in progress), so do it the long way
+		return get_freq(get_period(semitone)) / mix_rate
+
+
+	def get_fixed_step_rate(self, semitone, mix_rate):
+
+		# for the fixed-point engine: the pitch snaps to the 1/32 semitone grid and
+		# the step rate comes out as 16.16 fixed point
+
+		try:
+			table = self.fixed_tables[mix_rate]
+		except KeyError:
+			try:
+				table = self.tables[mix_rate]
+			except KeyError:
+				table = self.build_table(mix_rate)
+			table = self.fixed_tables[mix_rate] = [to_fixed(step_rate) for step_rate in table]
+
+		pitch = int(semitone*32)
+
+		if min_pitch <= pitch < max_pitch:
+			return table[pitch - min_pitch]
+
+		return to_fixed(get_freq(get_period(pitch/32)) / mix_rate)
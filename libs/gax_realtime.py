@@ -0,0 +1,399 @@
+from .gax_replayer import quantize, get_sample_width, output_formats
+
+import sys
+import time
+import array
+import threading
+import collections
+
+'''
+Realtime playback without blocking writes.
+A producer thread renders ticks ahead of time into a ring buffer, and the audio callback
+pulls however many samples the device asks for out of it. A slow tick (or a GC pause)
+only eats into the buffered audio instead of causing a dropout.
+Nothing in here touches PyAudio; gax_wrapper hooks it up to a callback stream.
+
+Changes to what's playing can't wait for the buffered audio to play out. So the buffer gets
+flushed: the device keeps a short stretch of what's buffered, the rest is dropped, and the
+replayer is put back to the state it had right where that stretch ends (a snapshot is kept for
+every buffered tick) before the change is applied. Transport changes (pausing the music,
+stopping, switching songs) fade that stretch out; everything else (sound effects, volumes)
+is spliced in without a fade, since the audio up to the cut is exactly what would have played.
+'''
+
+
+class ring_buffer:
+
+	'''
+	Single producer / single consumer byte ring buffer, no locks.
+	Only the producer thread moves write_count and only the consumer moves read_count,
+	and each side publishes its counter after it's done copying, so the other side
+	never sees half-written data.
+	'''
+
+	def __init__(self, capacity):
+
+		self.data     = bytearray(capacity)
+		self.capacity = capacity
+
+		self.write_count = 0 # bytes written so far (producer)
+		self.read_count  = 0 # bytes read so far (consumer)
+
+
+	def available(self):
+		return self.write_count - self.read_count
+
+	def free(self):
+		return self.capacity - self.available()
+
+
+	def write(self, data):
+
+		# copies as much of data as fits, returns how much that was
+
+		size  = min(len(data), self.free())
+		start = self.write_count % self.capacity
+		first = min(size, self.capacity - start)
+
+		self.data[start:start+first] = data[:first]
+		self.data[:size-first]       = data[first:size]
+
+		self.write_count += size
+		return size
+
+
+	def read(self, size):
+
+		# up to size bytes, fewer if that's all there is
+
+		size  = min(size, self.available())
+		start = self.read_count % self.capacity
+		first = min(size, self.capacity - start)
+
+		data = bytes(self.data[start:start+first]) + bytes(self.data[:size-first])
+
+		self.read_count += size
+		return data
+
+
+	def discard(self):
+		# drops everything buffered; consumer side only
+		self.read_count = self.write_count
+
+
+def apply_ramp(data, start, ramp_size, fade_in, output_format):
+
+	'''
+	Scales PCM by a linear ramp, for fading in or out. start is how far into the ramp
+	the first sample of data is.
+	'''
+
+	typecode, scale, offset = output_formats[output_format][:3]
+
+	samples = array.array(typecode, data)
+	if sys.byteorder == "big":
+		samples.byteswap()
+
+	if fade_in:
+		gains = ((start+i+1) / ramp_size for i in range(len(samples)))
+	else:
+		gains = ((ramp_size-start-i-1) / ramp_size for i in range(len(samples)))
+
+	faded = list((sample-offset) / scale * min(1, max(0, gain)) for sample, gain in zip(samples, gains))
+	return quantize(faded, len(faded), output_format)
+
+
+class realtime_player:
+
+	'''
+	Keeps a ring buffer filled with rendered audio on a background thread, and hands it out
+	in blocks of any size with render().
+
+	source:  callable that renders the next tick and returns it as PCM, or None once the song is over
+	rate:    mixing rate the source renders at
+	latency: how much audio (in seconds) the producer keeps buffered ahead of the device
+	max_tick_size: the most samples one tick can have, so a whole tick always fits in the buffer
+	get_state/set_state: snapshot and restore whatever the source renders from. Without them,
+		a flush just skips the audio it drops
+	flush_time: how long a change may take to be heard; the fades on pause / resume / flush take half of this
+	'''
+
+	def __init__(self, source, rate, latency=0.1, max_tick_size=1024, output_format="int8",
+		get_state=None, set_state=None, flush_time=0.02):
+
+		self.source        = source
+		self.rate          = rate
+		self.output_format = output_format
+		self.sample_width  = get_sample_width(output_format)
+		self.get_state     = get_state
+		self.set_state     = set_state
+
+		self.target_size = max(1, int(rate * latency)) * self.sample_width
+		self.ring = ring_buffer(self.target_size + 2 * max_tick_size * self.sample_width)
+		self.ramp_size = max(1, int(rate * flush_time / 2))
+
+		# while the buffer is full, check back a few times per latency period
+		self.poll_interval = min(0.005, latency / 4, flush_time / 4)
+
+		## producer side
+		self.pending     = b""    # the part of the last tick that didn't fit yet
+		self.skip        = 0      # bytes of the next tick that have been heard already (after a flush)
+		self.produced    = 0      # stream position of the end of everything the source rendered
+		self.stream_base = 0      # stream position = ring position + stream_base
+		self.ticks       = collections.deque() # (stream position, state before the tick) of every buffered tick
+		self.finished    = False  # the source ran out
+		self.stopping    = False
+		self.error       = None   # what stopped the producer thread, raised again on stop()
+		self.thread      = None
+
+		## main thread <-> producer
+		self.commands = collections.deque() # (command, fade) run on the producer thread, after a flush
+		self.command_error = None # a command that failed (the producer keeps going), raised on the next request()
+
+		## producer <-> consumer
+		self.cut_requested = False # producer: please flush
+		self.cut_fade      = True  # producer: fade out before the cut (or splice without one)
+		self.cut_position  = None  # consumer: the stream position the new audio starts at
+
+		## main thread -> consumer
+		self.pause_requested = False
+
+		## consumer side
+		self.paused    = False
+		self.cut_audio = b""   # audio taken out ahead of a cut (faded or not), played before anything else
+		self.fade_in   = 0     # samples of the ramp in that are left
+		self.underruns = 0     # render() calls that had to be padded with silence
+
+
+	def start(self):
+
+		if self.thread is not None:
+			return
+
+		self.stopping = False
+		self.thread = threading.Thread(target=self.producer_loop, daemon=True)
+		self.thread.start()
+
+
+	def stop(self):
+
+		self.stopping = True
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+		if self.error is not None:
+			raise self.error
+
+
+	## producer
+
+	def fill(self):
+
+		'''
+		Renders ticks until the buffer holds the target latency (or the song ends).
+		Runs on the producer thread; can also be called directly to prime the buffer
+		before the stream starts.
+		'''
+
+		# the ticks that have been played all the way through can't be gone back to anymore
+		played = self.ring.read_count + self.stream_base
+		while len(self.ticks) > 1 and self.ticks[1][0] <= played:
+			self.ticks.popleft()
+
+		while self.ring.available() < self.target_size and not self.stopping:
+
+			if not self.pending:
+				if self.finished:
+					return
+
+				if self.get_state != None:
+					self.ticks.append((self.produced, self.get_state()))
+
+				block = self.source()
+				if block is None:
+					if self.get_state != None:
+						self.ticks.pop()
+					self.finished = True
+					return
+
+				self.produced += len(block)
+				self.pending = block[self.skip:]
+				self.skip    = 0
+
+			written = self.ring.write(self.pending)
+			self.pending = self.pending[written:]
+			if self.pending:
+				return # full; the rest goes in once the consumer catches up
+
+
+	def flush(self, position, commands):
+
+		'''
+		Puts the source back to where the audio at stream position `position` got rendered, then runs
+		commands. The ring has to be empty (nothing after position is kept).
+		'''
+
+		self.stream_base = position - self.ring.write_count
+		self.pending = b""
+
+		if position < self.produced and self.ticks:
+			# the last tick that starts at or before position
+			start, state = self.ticks[0]
+			for tick in self.ticks:
+				if tick[0] > position:
+					break
+				start, state = tick
+			self.set_state(state)
+			self.produced = start
+			self.skip     = position - start
+		else:
+			self.produced = position
+
+		# every snapshot before the cut is gone too, so a later flush can't go back
+		# to a state from before these commands
+		self.ticks.clear()
+
+		for command, fade in commands:
+			try:
+				command()
+			except Exception as e:
+				self.command_error = e
+		self.finished = False
+
+
+	def producer_loop(self):
+
+		try:
+			while not self.stopping:
+
+				if self.commands:
+					# the ones queued so far; anything requested meanwhile waits for the next cut
+					commands = [self.commands.popleft() for i in range(len(self.commands))]
+
+					# hand the cut over to the consumer, which keeps (and maybe fades out) what's about to play
+					self.cut_position  = None
+					self.cut_fade      = any(fade for command, fade in commands)
+					self.cut_requested = True
+					while self.cut_position is None and not self.stopping:
+						time.sleep(self.poll_interval)
+					if self.stopping:
+						break
+					self.flush(self.cut_position, commands)
+					self.cut_requested = False
+
+				self.fill()
+				time.sleep(self.poll_interval)
+
+		except Exception as e:
+			self.error = e
+
+
+	## main thread
+
+	def request(self, command, fade=True):
+
+		'''
+		Runs command (a callable that changes what the source renders) on the producer thread,
+		between two ticks, with the buffered audio flushed, so the change is heard within
+		flush_time instead of after the whole latency. Every change to the source has to go
+		through here while the player runs; a flush puts back the state from before anything
+		that was changed directly.
+		fade: fade out before the change (for transport changes); otherwise the new audio is
+		spliced straight onto the old.
+		'''
+
+		if self.error is not None:
+			raise self.error # the producer has stopped, nothing would run this
+
+		if self.thread is None:
+			# no producer (or consumer) running, so it can all happen right here
+			self.ring.discard()
+			self.cut_audio = b""
+			self.flush(self.ring.read_count + self.stream_base, [(command, fade)])
+		else:
+			self.commands.append((command, fade))
+
+		if self.command_error is not None:
+			# this command's (without a producer) or an earlier one's
+			error, self.command_error = self.command_error, None
+			raise error
+
+
+	def pause(self):
+		self.pause_requested = True
+
+	def resume(self):
+		self.pause_requested = False
+
+
+	## consumer
+
+	def take_ramp(self, fade=True):
+		# takes the next bit of buffered audio out (faded out, or as is), returns where the stream is after it
+		ramp = self.ring.read(self.ramp_size * self.sample_width)
+		if fade:
+			ramp = apply_ramp(ramp, 0, len(ramp) // self.sample_width, False, self.output_format)
+		self.cut_audio += ramp
+		return self.ring.read_count + self.stream_base
+
+
+	def render(self, sample_count):
+
+		'''
+		The pull side: the next sample_count samples of PCM. If the producer hasn't kept up,
+		the rest is padded with silence (and counted in underruns).
+		'''
+
+		size = sample_count * self.sample_width
+
+		if self.pause_requested and not self.paused:
+			self.take_ramp()
+			self.paused = True
+		elif self.paused and not self.pause_requested:
+			self.paused  = False
+			self.fade_in = self.ramp_size
+
+		if self.cut_requested and self.cut_position is None:
+			if self.paused:
+				position = self.ring.read_count + self.stream_base
+			else:
+				# the kept bit covers the time the producer takes to render from the cut
+				position = self.take_ramp(self.cut_fade)
+			self.ring.discard()
+			if self.cut_fade:
+				self.fade_in = self.ramp_size
+			self.cut_position = position # the producer takes over from here
+
+		data = self.cut_audio[:size]
+		self.cut_audio = self.cut_audio[size:]
+
+		if not self.paused and len(data) < size:
+
+			new_data = self.ring.read(size - len(data))
+
+			if self.fade_in and new_data:
+				ramp_start = self.ramp_size - self.fade_in
+				fade_size  = min(self.fade_in * self.sample_width, len(new_data))
+				new_data = apply_ramp(new_data[:fade_size], ramp_start, self.ramp_size, True,
+					self.output_format) + new_data[fade_size:]
+				self.fade_in -= fade_size // self.sample_width
+
+			data += new_data
+
+			if len(data) < size and not self.cut_requested and not self.is_done():
+				self.underruns += 1
+
+		if len(data) < size:
+			data += quantize(list(), (size - len(data)) // self.sample_width, self.output_format)
+
+		return data
+
+
+	def is_done(self):
+		# the song ended and everything it rendered has been played
+		return self.finished and not self.pending and self.ring.available() == 0
+
+
+	def get_buffered_time(self):
+		return self.ring.available() / self.sample_width / self.rate
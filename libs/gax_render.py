@@ -0,0 +1,428 @@
+from .gax_replayer import replayer, quantize, get_sample_width, numpy_engines
+from .calc_mem     import refresh_rate
+from .gax_analyzer import get_sequencer_rows
+from .gax_segment_cache import get_span_timing
+
+import re
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+'''
+Headless rendering for the GAX replayer.
+Nothing in here touches PyAudio or an audio device, so it runs as fast as the CPU allows.
+'''
+
+
+def tick_channel(replayer_obj, ch, mixing_rate, fps=refresh_rate, gain=1,
+	major_version=3, minor_version=5, stream=None, perf_state=None):
+
+	# one music or FX channel, with the instruments and waveforms it plays from
+	# (perf_state: see channel.tick)
+	if ch < replayer_obj.num_channels:
+		instruments, samples = replayer_obj.instruments, replayer_obj.sample_bank
+	else:
+		instruments, samples = replayer_obj.fx_instruments, replayer_obj.fx_sample_bank
+
+	replayer_obj.channels[ch].tick(ch, replayer_obj,
+		instruments, samples,
+		stream, mixing_rate, fps,
+		gain=gain,
+		major_version=major_version,
+		minor_version=minor_version,
+		perf_state=perf_state)
+
+
+def get_silence(replayer_obj, mixing_rate, fps=refresh_rate):
+	# one tick of a silent channel, the same length a rendered one would have
+	if replayer_obj.engine in numpy_engines:
+		return np.zeros(int(mixing_rate/fps))
+	return [0] * int(mixing_rate/fps)
+
+
+def tick_channels(replayer_obj, module_data, mixing_rate, fps=refresh_rate, gain=1,
+	major_version=3, minor_version=5, stream=None):
+
+	'''
+	Runs one tick of every music and FX channel in a replayer (the channel half of GAX_play).
+	'''
+
+	for ch in range(replayer_obj.num_channels + (replayer_obj.num_fx_channels or 0)):
+		if ch < replayer_obj.num_channels and replayer_obj.music_paused:
+			# paused music channels keep their state and don't render anything
+			replayer_obj.channels[ch].output_buffer = get_silence(replayer_obj, mixing_rate, fps)
+			continue
+		tick_channel(replayer_obj, ch, mixing_rate, fps, gain=gain,
+			major_version=major_version, minor_version=minor_version, stream=stream)
+
+
+class offline_renderer:
+
+	'''
+	Renders a song tick by tick without an audio device.
+	Each tick comes out as signed 8-bit PCM, same as GAX_play(debug=True), unless another
+	output_format is picked (see gax_replayer.output_formats).
+	'''
+
+	def __init__(self, gax_mus_object, song_idx=0, rate=0, version=(3,5),
+		fps=refresh_rate, gax_fx_object=None, engine=None, output_format="int8"):
+
+		self.module_data = gax_mus_object
+
+		if gax_fx_object is not None:
+			self.vars = replayer(self.module_data, song_idx=song_idx,
+				allocate_fxch=True, fx_obj=gax_fx_object, engine=engine, output_format=output_format)
+		else:
+			self.vars = replayer(self.module_data, song_idx=song_idx, engine=engine, output_format=output_format)
+
+		if rate > 0:
+			self.mixing_rate = rate
+		else:
+			self.mixing_rate = self.vars.mixing_rate
+
+		self.fps  = fps
+		self.gain = 1
+
+		self.maj_version, self.min_version = version
+
+
+	def render_tick(self):
+
+		tick_channels(self.vars, self.module_data, self.mixing_rate, self.fps,
+			gain=self.gain,
+			major_version=self.maj_version,
+			minor_version=self.min_version)
+
+		return self.vars.tick(None, debug=True, export=True)
+
+
+	def is_finished(self, loops=1):
+		# a speed of 0 is how GAX ends a song; otherwise stop after the requested loops
+		return self.vars.speed[0] == 0 or self.vars.loop_count >= loops+1
+
+
+	def render_ticks(self, loops=1, reuse_loops=False, segment_cache=None):
+
+		'''
+		Generator that yields one tick of PCM at a time until the song ends
+		or has played the requested number of loops.
+
+		reuse_loops: compare the whole replayer state every time the song loops; once it
+		matches an earlier loop point, the rest is a repeat of what's already been rendered,
+		so those ticks get copied instead of rendered. Same output either way.
+
+		segment_cache: a gax_segment_cache.segment_cache to replay repeated pattern spans of
+		single channels from. Same output either way; takes the place of reuse_loops.
+		'''
+
+		if segment_cache != None:
+			yield from self.render_cached_segments(loops, segment_cache)
+			return
+
+		if reuse_loops:
+			yield from self.render_reused_loops(loops)
+			return
+
+		while self.vars.speed[0] != 0:
+			yield self.render_tick()
+			if self.vars.loop_count >= loops+1:
+				break
+
+
+	def render_reused_loops(self, loops=1, max_cached_loops=8):
+
+		wrap_keys = dict() # state at a loop point -> index into wraps
+		wraps     = list() # (blocks rendered up to that loop point, snapshot)
+		blocks    = list() # every tick since the first loop point
+		caching   = loops > 1 # with one loop there's nothing to reuse
+
+		while self.vars.speed[0] != 0:
+
+			loop_count = self.vars.loop_count
+			block = self.render_tick()
+			if caching and wraps:
+				blocks.append(block)
+
+			yield block
+			if self.vars.loop_count >= loops+1:
+				return
+
+			if not caching or self.vars.loop_count == loop_count:
+				continue
+
+			snapshot = self.get_snapshot()
+			try:
+				key = self.vars.get_key()
+				hash(key)
+			except TypeError:
+				key = None # something unhashable in there; just render everything
+
+			if key in wrap_keys:
+				break
+
+			if key == None or len(wraps) >= max_cached_loops:
+				# never settles (drifting envelopes, slides...), stop keeping ticks around
+				caching = False
+				blocks  = None
+				continue
+
+			wrap_keys[key] = len(wraps)
+			wraps.append((len(blocks), snapshot))
+
+		else:
+			return # the song ended
+
+		# from the matching loop point on, the song repeats itself
+		first = wrap_keys[key]
+		cycle = blocks[wraps[first][0]:]
+		cycle_wraps = [(wrap_blocks - wraps[first][0], wrap_snapshot)
+					   for wrap_blocks, wrap_snapshot in wraps[first+1:]] + [(len(cycle), snapshot)]
+
+		timer      = self.vars.timer
+		loop_count = self.vars.loop_count
+
+		while True:
+			start = 0
+			for end, wrap_snapshot in cycle_wraps:
+				yield from cycle[start:end]
+				timer      += end - start
+				loop_count += 1
+				start = end
+
+				if loop_count >= loops+1:
+					# leave the replayer where a full render would have (up to counters get_key ignores)
+					self.restore_snapshot(wrap_snapshot)
+					self.vars.timer      = timer
+					self.vars.loop_count = loop_count
+					return
+
+
+	def render_cached_segments(self, loops, cache):
+
+		replayer_obj   = self.vars
+		sequencer_rows = get_sequencer_rows(replayer_obj.timeline)
+		channel_count  = replayer_obj.num_channels + (replayer_obj.num_fx_channels or 0)
+
+		# everything else a span's audio depends on
+		context = (id(self.module_data), self.mixing_rate, self.fps, self.gain,
+				   self.maj_version, self.min_version, replayer_obj.engine, replayer_obj.mix_amp)
+
+		# per music channel: [key, ticks, tick index, exit state]; exit state is None while recording
+		spans = [None] * replayer_obj.num_channels
+
+		while replayer_obj.speed[0] != 0:
+
+			for ch in range(channel_count):
+				span = spans[ch] if ch < replayer_obj.num_channels else None
+
+				if span == None:
+					tick_channel(replayer_obj, ch, self.mixing_rate, self.fps, gain=self.gain,
+						major_version=self.maj_version, minor_version=self.min_version)
+				elif span[3] != None:
+					replayer_obj.channels[ch].output_buffer = span[1][span[2]]
+				else:
+					tick_channel(replayer_obj, ch, self.mixing_rate, self.fps, gain=self.gain,
+						major_version=self.maj_version, minor_version=self.min_version)
+					span[1].append(replayer_obj.channels[ch].output_buffer)
+
+				if span != None:
+					span[2] += 1
+
+			row = self.get_next_row()
+			if row != None and row[1] == 0:
+
+				# a new position starts on this tick, so the spans end here
+				for ch in range(replayer_obj.num_channels):
+					span = spans[ch]
+					if span == None:
+						continue
+
+					bank    = replayer_obj.get_channel_bank(ch)
+					channel = replayer_obj.channels[ch]
+
+					if span[3] != None:
+						output = channel.output_buffer
+						channel.set_state(span[3], bank)
+						channel.output_buffer = output
+					else:
+						cache.put(span[0], span[1], channel.get_state(bank))
+
+					spans[ch] = None
+
+			block = replayer_obj.tick(None, debug=True, export=True)
+
+			if row != None and row[1] == 0:
+
+				timing = get_span_timing(replayer_obj, sequencer_rows, loops)
+				if timing != None: # a span that doesn't get to finish is just rendered
+					for ch in range(replayer_obj.num_channels):
+						pattern, transpose = replayer_obj.timeline.order[row[0]][ch]
+						key = (context, pattern, transpose, timing,
+							   replayer_obj.channels[ch].get_key(replayer_obj.get_channel_bank(ch)))
+
+						try:
+							entry = cache.get(key)
+						except TypeError:
+							continue # something unhashable in the state
+
+						if entry != None:
+							spans[ch] = [key, entry[0], 0, entry[1]]
+						else:
+							spans[ch] = [key, list(), 0, None]
+
+			yield block
+			if replayer_obj.loop_count >= loops+1:
+				break
+
+
+	def get_snapshot(self):
+		# see replayer.get_snapshot
+		return self.vars.get_snapshot()
+
+
+	def restore_snapshot(self, snapshot):
+		self.vars.restore_snapshot(snapshot)
+
+
+	def get_next_row(self):
+		# (position, step) the next tick reads, or None if it doesn't read a row
+		if self.vars.speed_timer <= 0 and self.vars.speed[0] != 0:
+			return (self.vars.cur_pat, self.vars.cur_step)
+		return None
+
+
+	def get_stem_names(self):
+		# music channels first, then the FX channels, in the replayer's channel order
+		names = ["ch{:0>2}".format(ch+1) for ch in range(self.vars.num_channels)]
+		if self.vars.num_fx_channels:
+			names += ["fx{:0>2}".format(ch+1) for ch in range(self.vars.num_fx_channels)]
+		return names
+
+
+	def get_stems(self, sample_count):
+
+		'''
+		The last tick's output of every channel, one block per channel.
+		Uses the same gain, quantization and output format as the mix.
+		'''
+
+		channel_count = len(self.get_stem_names())
+		return [quantize(self.vars.channels[ch].output_buffer, sample_count, self.vars.output_format)
+				for ch in range(channel_count)]
+
+
+	def render_stem_ticks(self, loops=1):
+
+		'''
+		Like render_ticks, but yields (mix, stems) for every tick, so the mix and every
+		channel's stem come out of the same render pass.
+		'''
+
+		for block in self.render_ticks(loops):
+			yield block, self.get_stems(len(block) // get_sample_width(self.vars.output_format))
+
+
+class checkpoint_index:
+
+	'''
+	Snapshots of a renderer taken every `interval` positions, so seeking only has to
+	render from the nearest checkpoint instead of from the start of the song.
+
+	build() makes the pre-pass: one pass through the song (up to the first loop back or
+	the end), rendering without keeping the audio. A checkpoint is the state right before
+	the tick that reads step 0 of a position.
+
+	The pre-pass costs as much as rendering that pass for real: the channels' sample
+	positions depend on every sample mixed, so there's no cheaper sequencer-only way to
+	get exact snapshots. Only the first pass gets checkpoints; positions are seeked to
+	within that pass.
+	'''
+
+	def __init__(self, renderer, interval=4):
+
+		self.renderer = renderer
+		self.interval = max(1, interval)
+
+		self.start       = renderer.get_snapshot() # wherever the renderer was when the index was made
+		self.checkpoints = dict() # position -> snapshot
+
+
+	def build(self):
+
+		# a full render of one pass through the song (see above), so build it once and keep it
+		renderer = self.renderer
+		resume   = renderer.get_snapshot()
+
+		renderer.restore_snapshot(self.start)
+		self.checkpoints.clear()
+
+		while renderer.vars.speed[0] != 0 and renderer.vars.loop_count == self.start.loop_count:
+
+			row = renderer.get_next_row()
+			if row != None and row[1] == 0 and row[0] % self.interval == 0 and row[0] not in self.checkpoints:
+				self.checkpoints[row[0]] = renderer.get_snapshot()
+
+			renderer.render_tick()
+
+		renderer.restore_snapshot(resume)
+		return self
+
+
+	def seek(self, position, step=0):
+
+		'''
+		Puts the renderer right before the tick that reads (position, step), starting from
+		the closest checkpoint at or before it. If a pattern break skips that step, it stops
+		at the next row that does get read instead.
+		Returns the number of ticks that had to be rendered.
+		'''
+
+		earlier = [checkpoint for checkpoint in self.checkpoints if checkpoint <= position]
+		if earlier:
+			self.renderer.restore_snapshot(self.checkpoints[max(earlier)])
+		else:
+			self.renderer.restore_snapshot(self.start)
+
+		renderer = self.renderer
+		ticks    = 0
+
+		while renderer.vars.speed[0] != 0:
+
+			row = renderer.get_next_row()
+			if row != None and row >= (position, step):
+				break
+
+			loop_count = renderer.vars.loop_count
+			renderer.render_tick()
+			ticks += 1
+
+			if renderer.vars.loop_count != loop_count:
+				break # went past the end of the song without reaching it
+
+		return ticks
+
+
+def render(module, song_idx=0, loops=1, rate=0, version=(3,5), fps=refresh_rate, engine=None,
+	output_format="int8"):
+
+	'''
+	Renders a whole song offline and returns it as mono PCM, signed 8-bit by default.
+
+	rate:    mixing rate to render at; 0 uses the song's own mixing rate
+	version: (major, minor) GAX version to emulate
+	output_format: one of gax_replayer.output_formats
+	'''
+
+	renderer = offline_renderer(module, song_idx, rate=rate, version=version, fps=fps, engine=engine,
+		output_format=output_format)
+	return b''.join(renderer.render_ticks(loops))
+
+
+def get_wave_name(gax_obj, song_idx, mixing_rate):
+	'''
+	File name used for a rendered song, e.g. "01 ~ Title (15 khz).wav"
+	'''
+	song_title = re.sub(r"[\\\/:*?\"<>|]", "~", gax_obj.get_song_name(song_idx), 0, re.MULTILINE)
+	return "{:0>2X} ~ {} ({} khz).wav".format(song_idx, song_title, int(mixing_rate/1000))
@@ -1,10 +1,28 @@
-from . import shinen_gax as gax
+import sys
+import array
 import struct
 
 from .general import get_period, get_freq
+from .gax_pitch import pitch_table
+from .gax_sample_bank import sample_bank, get_sample_bank
+from .gax_instrument import (
+	instrument_bank, get_instrument_bank,
+	op_pitch_slide, op_volume_slide, op_jump, op_jump_delay, op_set_volume, op_set_speed
+)
+from .gax_envelope import tick_volenv, calc_volenv_lerp, keep
+from .gax_timeline import song_timeline
+from .gax_audio import render_wave_positions, render_modulator_positions, render_output
+from .gax_fixed import (
+	fixed_one, to_fixed, render_fixed_positions, render_fixed_modulator, get_fixed_volumes, render_fixed_output
+)
 from .gax_constants import sine_table
 from .gax_constructors import wave_param
 
+try:
+	import numpy as np
+except ImportError:
+	np = None # only needed for the block renderer
+
 
 '''
 to do:
@@ -20,16 +38,83 @@ to do:
 '''
 
 
-def get_patterns_at_idx(song_data, idx):
-	return(list(i[idx] for i in song_data.get_order_list()))
-
 # https://stackoverflow.com/questions/9775731/clamping-floating-numbers-in-python#13232356
 def clamp(mini, maxim, val):
 	return min(max(mini, val), maxim)
 
+# engines that render whole ticks with NumPy and mix with the NumPy mixer
+numpy_engines = ("numpy", "fixed")
+
+# sample formats the mixer can put out
+# name: (array typecode, scale from the mixer's 8-bit range, offset, lowest, highest)
+output_formats = {
+	"int8":    ("b", 1,     0,   -128,   127),   # what the GBA puts out
+	"uint8":   ("B", 1,     128, -128,   127),   # the same samples, stored the way 8-bit .wav files want them
+	"int16":   ("h", 256,   0,   -32768, 32767),
+	"float32": ("f", 1/128, 0,   None,   None),  # +-1.0 is full scale; a mix that goes over is kept as is
+	"float64": ("d", 1,     0,   None,   None)   # the mix as the mixer has it, before any quantizing (for further processing)
+}
+
+def get_sample_width(output_format):
+	return array.array(output_formats[output_format][0]).itemsize
+
+def quantize(buffer, sample_count, output_format="int8"):
+	'''
+	Converts a float buffer to little endian PCM in one of the output_formats, the same way the
+	mixer does (integer formats get rounded half to even and clamped, float32 is only scaled).
+	The result is cut or padded with silence to sample_count samples.
+	'''
+	typecode, scale, offset, lowest, highest = output_formats[output_format]
+	used = min(len(buffer), sample_count)
+
+	if np != None:
+		samples = np.zeros(sample_count)
+		samples[:used] = buffer[:used]
+		if scale != 1:
+			samples *= scale
+		if lowest != None:
+			np.rint(samples, out=samples)
+			np.clip(samples, lowest, highest, out=samples)
+		if offset:
+			samples += offset
+		return samples.astype(np.dtype(typecode).newbyteorder("<")).tobytes()
+
+	samples = list(i*scale for i in buffer[:used]) + [0] * (sample_count - used)
+	if lowest != None:
+		samples = list(clamp(lowest, highest, round(i)) + offset for i in samples)
+	converted = array.array(typecode, samples)
+	if sys.byteorder == "big":
+		converted.byteswap()
+	return converted.tobytes()
+
 
 class channel:
-	
+
+	# fixed attribute slots instead of a per-channel __dict__: faster attribute access
+	# in the per-sample loop, and a lot less memory per channel when many replayers
+	# are kept around. every attribute a channel uses has to be listed here
+	__slots__ = (
+		"timer", "instrument_idx",
+		"delay_tick_count", "delay_timer", "delay_finished",
+		"semitone", "old_perf_semitone", "perf_semitone", "perf_pitch", "is_fixed",
+		"note_slide_amount", "perf_note_slide_amount",
+		"old_semitone", "target_semitone", "is_tone_porta", "tone_porta_lerp",
+		"vol_slide_amount", "perf_vol_slide_amount",
+		"perf_row_idx", "perf_row_buffer", "perf_row_delay", "perf_row_speed",
+		"perf_row_volume", "perf_row_timer", "perf_list_end",
+		"wave_params", "wave_step_rate", "wave_idx", "wave_position", "wave_direction", "wave_output",
+		"modulate_size", "modulate_step", "modulate_speed", "is_modulate",
+		"modulate_timer", "modulate_position", "modulate_subposition", "modulate_final_pos",
+		"modulate_step_rate", "modulate_direction",
+		"use_vibrato", "is_vibrato", "vibrato_timer", "vibrato_subtimer",
+		"vibrato_init", "vibrato_depth", "vibrato_speed", "vibrato_pitch",
+		"instrument_data", "volenv_timer", "volenv_buffer", "volenv_idx", "volenv_cur_vol", "volenv_lerp",
+		"volenv_pause", "volenv_pause_point", "volenv_note_off", "volenv_turning_off",
+		"volenv_loop", "volenv_has_looped", "volenv_end",
+		"step_volume", "mix_volume", "is_active", "priority",
+		"output_buffer"
+	)
+
 	def __init__(self):
 
 		self.timer = 0
@@ -137,147 +222,176 @@ class channel:
 		self.output_buffer = list()
 
 
-	def calc_volenv_lerp(self):
-		try:
-			volenv_a = self.volenv_buffer[self.volenv_idx]
-			volenv_b = self.volenv_buffer[self.volenv_idx-1]
-			self.volenv_lerp = ((volenv_b[1]-volenv_a[1])/(volenv_b[0]-volenv_a[0]))
-		except:
-			self.volenv_lerp = 0
+	# the envelope state machine lives in gax_envelope, so the envelope tables can run it too
+	calc_volenv_lerp = calc_volenv_lerp
+	tick_volenv      = tick_volenv
 
 
-	def tick_volenv(self):
+	## snapshots
+	# everything except the references into the compiled instruments (saved as indices, so
+	# a snapshot is plain data) and the last tick's output (every tick writes a new one)
 
+	state_fields = tuple(name for name in __slots__ if name not in
+		("instrument_data", "perf_row_buffer", "volenv_buffer", "wave_params", "output_buffer"))
 
-		if len(self.volenv_buffer) > 1: # only read in volenv if there is any data
+	def get_state(self, instrument_set):
 
-			if not self.volenv_turning_off:
-				self.volenv_loop = (self.instrument_data.volume_envelope["loop_start"] != None
-									and self.instrument_data.volume_envelope["loop_end"] != None)
-									# detect when it's appropriate to loop our volume envelope
-			else:
-				self.volenv_loop = False
+		'''
+		The channel's playback state as a tuple. instrument_set is the compiled bank the
+		channel plays from, used to turn the wave params back into (instrument, slot) indices.
+		'''
 
-			# shifts the envelope over 1 tick forward.
-			# this fixes envelope sidechains in Iridion II / 3D and Jackie Chan Adventures
-			kludge = 1 if self.volenv_idx else 0
+		wave_params = None
+		if self.wave_params != None:
+			# usually from the current instrument, but a new instrument without a
+			# matching slot keeps the previous one's
+			for instr_idx in [self.instrument_idx] + list(range(len(instrument_set))):
+				slots = instrument_set[instr_idx].wave_params
+				if self.wave_params in slots:
+					wave_params = (instr_idx, slots.index(self.wave_params))
+					break
 
-			if self.timer == self.volenv_buffer[self.volenv_idx][0] + kludge:
-				self.volenv_has_looped = False
-					  
-				# if our timer matches the current envelope point's time (X),
-				# we increment the volenv_idx variable by 1 and set the appropriate volume
-				
-				if not self.volenv_pause:
-					self.volenv_cur_vol = self.volenv_buffer[self.volenv_idx][1]
-					self.volenv_idx += 1
-				
-				if not self.volenv_loop: 
-					if self.volenv_idx >= len(self.instrument_data.volume_envelope["points"]):
-						self.volenv_idx = 0
-						self.volenv_lerp = 0
-						self.volenv_end = True
-						self.is_active = False
-						
-				if self.volenv_loop: 
-					if self.volenv_idx > self.instrument_data.volume_envelope["loop_end"]:
-						self.volenv_idx = self.instrument_data.volume_envelope["loop_start"]
-						self.timer = self.volenv_buffer[self.volenv_idx][0] # extremely shit solution but it works
-						self.volenv_has_looped = True		
+		return (tuple(getattr(self, name) for name in self.state_fields),
+				self.instrument_data != None, wave_params)
+
+
+	# volenv_timer is only ever written, so it's left out; get_key cuts the other three down
+	key_fields = tuple(name for name in state_fields if name not in
+		("volenv_timer", "timer", "vibrato_timer", "vibrato_subtimer"))
+
+	def get_key(self, instrument_set):
+
+		'''
+		Like get_state, but only what decides the audio from here on, for comparing states
+		(loop points, cached spans). The counters that keep going on a held note are cut down
+		to what's still read of them, so two states that play the same compare the same.
+		'''
 
+		state = self.get_state(instrument_set)
 
+		# the timer only gets compared with the envelope points (and 0)
+		timer_limit = self.instrument_data.volenv_table.timer_limit if self.instrument_data != None else 1
+		# the vibrato wait only checks for vibrato_init, and the vibrato reads the sine table mod 64
+		vibrato_timer = min(self.vibrato_timer, self.vibrato_init + 1)
+
+		return (tuple(getattr(self, name) for name in self.key_fields),
+				min(self.timer, timer_limit), vibrato_timer, self.vibrato_subtimer % 64) + state[1:]
+
+
+	def set_state(self, state, instrument_set):
+
+		fields, has_instrument, wave_params = state
+
+		for name, value in zip(self.state_fields, fields):
+			setattr(self, name, value)
+
+		if has_instrument:
+			self.instrument_data = instrument_set[self.instrument_idx]
+			self.perf_row_buffer = self.instrument_data.perf_rows
+			self.volenv_buffer   = self.instrument_data.volenv_points
 		else:
-			# no volume envelope here
-			self.volenv_cur_vol = self.volenv_buffer[self.volenv_idx][1]
-			self.volenv_lerp = 0
+			self.instrument_data = None
+			self.perf_row_buffer = None
+			self.volenv_buffer   = None
 
+		if wave_params != None:
+			self.wave_params = instrument_set[wave_params[0]].wave_params[wave_params[1]]
+		else:
+			self.wave_params = None
 
-		# envelope lerping
+		self.output_buffer = list()
 
-		if len(self.volenv_buffer) > 1:
 
-			if not self.volenv_end:
-				# prevent the sample from getting louder and scaring the elderly
-				if not self.volenv_pause:
-					self.calc_volenv_lerp()
-			else:
-				# fixes instrument #24 in SpongeBob SquarePants: Battle for Bikini Bottom
-				self.volenv_turning_off = False
+	def step_volenv(self, sample_count):
 
+		'''
+		Does what sample_count calls of tick_volenv would (one per output sample), by looking
+		the whole tick up in the instrument's envelope table.
+		Returns the envelope volume as (sample count, volume) runs.
+		'''
 
-			# sustain point handler
-			if self.volenv_idx-1 == self.volenv_pause_point: # when we reach the sustain point
-				self.volenv_pause = True
-				self.volenv_lerp = 0 # *stop* on the sustain point
+		tick = self.instrument_data.volenv_table.get_tick(self, sample_count)
 
-			# sustain / pause handling
+		runs   = list()
+		volume = self.volenv_cur_vol
+		for count, new_volume in tick.volumes:
+			if new_volume is not keep:
+				volume = new_volume
+			runs.append((count, volume))
 
-			if not self.volenv_pause:
-				self.volenv_timer += 1
+		self.volenv_cur_vol = volume
+		if tick.lerp is not keep:
+			self.volenv_lerp = tick.lerp
+		if tick.timer is not keep:
+			self.timer = tick.timer
 
-			if self.volenv_pause_point != None: # if there even exists a sustain point:
-				if self.volenv_note_off == True:
-					# reset to where we were before the sustain pause
-					self.volenv_pause = False
-					self.volenv_idx = self.volenv_pause_point
-					self.timer = self.volenv_buffer[self.volenv_pause_point][0]
-					self.volenv_pause_point = None
-					self.volenv_note_off = False
-					self.volenv_turning_off = True
+		(self.volenv_idx, self.volenv_pause, self.volenv_pause_point, self.volenv_note_off,
+		 self.volenv_turning_off, self.volenv_loop, self.volenv_has_looped, self.volenv_end) = tick.state
 
+		self.volenv_timer += tick.volenv_timer
+		if tick.deactivate:
+			self.is_active = False
 
-		if self.volenv_pause_point == None and self.volenv_note_off:
-			# fixes a few tracks in Rayman - Raving Rabbids (U)
-			self.volenv_cur_vol = 0
-			self.volenv_lerp = 0
+		return runs
 
 
-	def tick_audio(self, mix_rate, wave_bank, stream, fps=60, gain=1, debug=False):
+	def calc_step_rate(self, mix_rate, pitch_table=None, fixed=False):
 
 		'''
-		current bugs:
-		> envelope pause timing / note off timing is inconsistent during speed modulation (cases - Jazz Jackrabbit, SpongeBob: Lights Camera Pants)
+		Works out the loop outcome and the wave / modulator step rates for this tick.
+		With fixed, the step rates are 16.16 fixed point (for the fixed-point engine).
+		Returns (play_once, is_invalid_loop).
 		'''
 
-		self.output_buffer = list()
+		if fixed:
+			# only the replayer runs the fixed-point engine, and it always passes its table in
+			get_step_rate = pitch_table.get_fixed_step_rate
+			step_one = fixed_one
+		elif pitch_table != None:
+			get_step_rate = pitch_table.get_step_rate
+			step_one = 1
+		else:
+			get_step_rate = lambda semitone, mix_rate: get_freq(get_period(semitone)) / mix_rate
+			step_one = 1
 
-		if self.wave_params != None:
+		wave_params = self.wave_params
 
-			# determine loop outcome from loop points
-			is_invalid_loop = (self.wave_params["loop_end"] - self.wave_params["loop_start"] < 0)
-			play_once       = (self.wave_params["loop_end"] == 0 and self.wave_params["loop_start"] == 0)
+		if wave_params != None:
+
+			# loop outcome, worked out when the instrument was compiled
+			is_invalid_loop = wave_params.is_invalid_loop
+			play_once       = wave_params.play_once
 
 			# get modulation values
-			self.is_modulate = (self.wave_params['modulate'] and not is_invalid_loop
-								and self.wave_params['modulate_speed'] > 0)
+			self.is_modulate = wave_params.is_modulate
 			if self.is_modulate:
-				self.modulate_size  = self.wave_params['modulate_size']
-				self.modulate_step  = self.wave_params['modulate_step']
-				self.modulate_speed = self.wave_params['modulate_speed']
+				self.modulate_size  = wave_params.modulate_size
+				self.modulate_step  = wave_params.modulate_step
+				self.modulate_speed = wave_params.modulate_speed
 
 			# apply finetune to both step rates
 
 			if not self.is_fixed:
 
 				if not self.is_modulate:
-					self.wave_step_rate = (get_freq(get_period(
-										   (self.perf_semitone + (self.wave_params["finetune"]/32) 
-										   	+ self.vibrato_pitch) + self.semitone)) / mix_rate) 
+					self.wave_step_rate = get_step_rate(
+										   (self.perf_semitone + wave_params.finetune_semitones
+										   	+ self.vibrato_pitch) + self.semitone, mix_rate)
 				else:
-					self.modulate_step_rate = (get_freq(get_period(
-										   (self.perf_semitone + (self.wave_params["finetune"]/32)
-										   	+ self.vibrato_pitch) + self.semitone)) / mix_rate) 
+					self.modulate_step_rate = get_step_rate(
+										   (self.perf_semitone + wave_params.finetune_semitones
+										   	+ self.vibrato_pitch) + self.semitone, mix_rate)
 
 			else:
 
 				if not self.is_modulate:
-					self.wave_step_rate = (get_freq(get_period(
-									   self.perf_semitone + (self.wave_params["finetune"]/32)
-									   + self.vibrato_pitch))) / mix_rate 
+					self.wave_step_rate = get_step_rate(
+									   self.perf_semitone + wave_params.finetune_semitones
+									   + self.vibrato_pitch, mix_rate)
 				else:
-					self.modulate_step_rate = self.modulate_step + (get_freq(get_period(
-									   self.perf_semitone + (self.wave_params["finetune"]/32)
-									   + self.vibrato_pitch))) / mix_rate 
+					self.modulate_step_rate = self.modulate_step*step_one + get_step_rate(
+									   self.perf_semitone + wave_params.finetune_semitones
+									   + self.vibrato_pitch, mix_rate)
 
 		else:
 
@@ -289,124 +403,120 @@ class channel:
 			self.is_modulate = False
 
 			if not self.is_fixed:
-				self.wave_step_rate = (get_freq(get_period((self.perf_semitone) + self.semitone)) / mix_rate)
+				self.wave_step_rate = get_step_rate((self.perf_semitone) + self.semitone, mix_rate)
 			else:
-				self.wave_step_rate = (get_freq(get_period((self.perf_semitone))) / mix_rate)
-
+				self.wave_step_rate = get_step_rate((self.perf_semitone), mix_rate)
 
-		for i in range(int(mix_rate/fps)):
+		return play_once, is_invalid_loop
 
-			if self.wave_idx >= len(wave_bank): # accurate GAX behavior
-				break
 
-			if self.is_modulate:
+	def control_tick(self, sample_count, mix_rate, fps):
 
-				self.modulate_subposition += self.modulate_step_rate
-				self.modulate_subposition %= self.modulate_size
+		'''
+		The control-rate half of tick_audio: the volume envelope, pitch slides, tone portamento
+		and volume slides for one tick. Returns the volume factor of every sample in the tick.
+		The per-sample sums are still done one sample at a time (in locals), so they round the
+		same way the old per-sample loop did.
+		'''
 
-				if self.wave_params != None:
-					self.modulate_final_pos = (self.modulate_position + self.modulate_subposition) + self.wave_params["start_position"]
-				else:
-					self.modulate_final_pos = (self.modulate_position + self.modulate_subposition)
+		gains = list()
 
-			else:
+		note_step   = self.note_slide_amount/(mix_rate*(fps/1.875)/fps)   #cross checked with custom porta down tracks / Sigma Star Saga
+		porta_step  = self.tone_porta_lerp/(mix_rate/fps)
+		volume_step = self.vol_slide_amount/(mix_rate/fps)
 
-				self.wave_position += self.wave_step_rate*self.wave_direction
+		row_volume    = self.perf_row_volume/255
+		semitone      = self.semitone
+		step_volume   = self.step_volume
+		is_tone_porta = self.is_tone_porta
+		target_pitch  = self.target_semitone*32
 
-			
-			# read through the waveform data
-					
-			if len(wave_bank[self.wave_idx]) > 0:
+		for count, env_volume in self.step_volenv(sample_count):
+			for i in range(count):
 
-				if not play_once:
+				semitone    += note_step
+				semitone    += porta_step
+				step_volume += volume_step
 
-					if not self.is_modulate:
+				if is_tone_porta:
+					if int(semitone*32) == target_pitch:
+						# this multiplies the two vals by 32 since
+						# if we just naively check the semitones here,
+						# it works, but downwards portamentos that range 1 semitone
+						# just unnaturally "snap" to the target semitone
+						self.tone_porta_lerp = 0
+						porta_step    = self.tone_porta_lerp/(mix_rate/fps)
+						is_tone_porta = False
+						semitone      = self.target_semitone
 
-						# looping handlers
-						if (self.wave_position > len(wave_bank[self.wave_idx])
-							or self.wave_position > self.wave_params["loop_end"]):
-							if self.wave_params["ping_pong"]:
-								# bidi loop
-								self.wave_direction = -1
-							else:
-								# forward loop
-								# adapted from https://github.com/Prezzodaman/pymod
-								self.wave_position -= self.wave_params["loop_end"] - self.wave_params["loop_start"]
+				# apply volume transformations
+				gains.append(((row_volume * step_volume/255) * env_volume/255))
+				# clamp step volume into normal bounds
+				step_volume = clamp(0, 255, step_volume)
 
+		self.semitone      = semitone
+		self.step_volume   = step_volume
+		self.is_tone_porta = is_tone_porta
 
-						if (self.wave_position <= 0 or self.wave_position <= self.wave_params["loop_start"]):
-							if self.wave_params["ping_pong"]:
-								# return from backwards reading
-								self.wave_direction = 1
+		return gains
 
-					else:
 
-						if self.modulate_final_pos > self.wave_params["loop_end"]-1:
-							self.modulate_direction = -1
+	def tick_audio(self, mix_rate, sample_bank, stream, fps=60, gain=1, debug=False, pitch_table=None):
 
-						if self.modulate_final_pos < self.wave_params["loop_start"]:
-							self.modulate_direction = 1
+		'''
+		current bugs:
+		> envelope pause timing / note off timing is inconsistent during speed modulation (cases - Jazz Jackrabbit, SpongeBob: Lights Camera Pants)
+		'''
 
+		self.output_buffer = list()
 
-			else:
-				# don't attempt to read from an empty sample
-				self.wave_position     = 0
-				self.modulate_position = 0
+		play_once, is_invalid_loop = self.calc_step_rate(mix_rate, pitch_table)
 
-			if not self.is_modulate:
+		if self.wave_idx >= sample_bank.count: # accurate GAX behavior
+			self.tick_modulators()
+			return
 
-				if self.wave_position >= len(wave_bank[self.wave_idx]):
-					self.wave_position = len(wave_bank[self.wave_idx]) - 1
-				elif self.wave_position < 0:
-					self.wave_position = 0
-				
-				if (self.wave_position >= len(wave_bank[self.wave_idx]) 
-					or self.wave_position < 0):
-					self.wave_position = 0
+		wave        = sample_bank.waves[self.wave_idx] # already signed
+		wave_length = sample_bank.lengths[self.wave_idx]
+		wave_loop   = sample_bank.get_loop(self.wave_idx, self.wave_params)
 
+		sample_count = int(mix_rate/fps)
 
-			self.tick_volenv()
+		## control stage: envelope, slides and volume, worked out for the whole tick
 
-			self.semitone    += self.note_slide_amount/(mix_rate*(fps/1.875)/fps)   #cross checked with custom porta down tracks / Sigma Star Saga
-			self.semitone    += self.tone_porta_lerp/(mix_rate/fps)
-			self.step_volume += self.vol_slide_amount/(mix_rate/fps)
+		gains = self.control_tick(sample_count, mix_rate, fps)
 
-			if self.is_tone_porta:
-				if int(self.semitone*32) == self.target_semitone*32:
-					# this multiplies the two vals by 32 since
-					# if we just naively check the semitones here,
-					# it works, but downwards portamentos that range 1 semitone
-					# just unnaturally "snap" to the target semitone
-					self.tone_porta_lerp = 0
-					self.is_tone_porta = False
-					self.semitone = self.target_semitone
+		## audio stage: waveform positions, reads and gain
 
+		if self.is_modulate:
+			(positions, self.modulate_subposition, final_pos, self.modulate_position,
+			 self.modulate_direction) = render_modulator_positions(
+				self.modulate_subposition, self.modulate_position, wave_loop.start_position,
+				self.modulate_step_rate, self.modulate_size, sample_count, wave_length,
+				wave_loop.loop_start, wave_loop.loop_end, self.modulate_direction, play_once)
+			if final_pos != None:
+				self.modulate_final_pos = final_pos
+		else:
+			positions, self.wave_position, self.wave_direction = render_wave_positions(
+				self.wave_position, self.wave_direction, self.wave_step_rate, sample_count, wave_length,
+				wave_loop.upper_bound, wave_loop.lower_bound, wave_loop.loop_end - wave_loop.loop_start,
+				wave_loop.ping_pong, play_once)
 
-			# output the current instrument's work
-			if self.wave_idx != 0: #do not attempt to read sample #0 -> reserved empty sample
-
-				if not self.is_modulate:
-					self.wave_output = (wave_bank[self.wave_idx][int(self.wave_position)] - 128)
-				else:
-					try:
-						self.wave_output = wave_bank[self.wave_idx][int(self.modulate_final_pos)] - 128
-					except:
-						pass
+		if wave_length == 0 and sample_count > 0:
+			# don't attempt to read from an empty sample
+			self.wave_position     = 0
+			self.modulate_position = 0
 
+		# do not attempt to read sample #0 -> reserved empty sample
+		self.output_buffer, self.wave_output = render_output(wave, positions, self.wave_output, gains,
+			gain * self.mix_volume, self.wave_idx != 0, self.is_modulate)
 
-			# apply volume transformations
+		self.tick_modulators()
 
-			self.wave_output *= (((self.perf_row_volume/255) * self.step_volume/255) * self.volenv_cur_vol/255)
-			# clamp step volume into normal bounds
-			self.step_volume = clamp(0, 255, self.step_volume)
-			if self.step_volume < 0:
-				self.vol_slide_amount = 0
 
-			# apply mix volume / gain to our wave output
-			self.wave_output *= (gain * self.mix_volume)
-			# convert to a signed buffer list
-			self.output_buffer.append(self.wave_output)
+	def tick_modulators(self):
 
+		# runs once per tick, after the audio has been rendered
 
 		if self.is_modulate:
 			self.modulate_timer += 1
@@ -431,107 +541,474 @@ class channel:
 					self.vibrato_pitch = 0
 
 
-	def tick_perf_list(self, wave_bank, reset_volume=True):
+	## block renderer
+	# renders the same samples as tick_audio, one whole tick at a time.
+	# every running sum is done with np.add.accumulate, which adds strictly
+	# left to right, so the floats come out exactly like the per-sample loop.
+
+	def render_volenv(self, sample_count):
+
+		# the envelope table already has the tick as runs of one volume
+		counts, volumes = zip(*self.step_volenv(sample_count))
+		return np.repeat(np.array(volumes, dtype=np.float64), counts)
+
+
+	def render_slides(self, sample_count, mix_rate, fps):
+
+		# semitone slides / tone portamento (only the end result is audible, on the next tick)
+
+		note_step  = self.note_slide_amount/(mix_rate*(fps/1.875)/fps)
+		porta_step = self.tone_porta_lerp/(mix_rate/fps)
+
+		steps = np.empty(sample_count*2 + 1)
+		steps[0]    = self.semitone
+		steps[1::2] = note_step
+		steps[2::2] = porta_step
+		semitones = np.add.accumulate(steps)[2::2]
+
+		semitone = float(semitones[-1])
+
+		if self.is_tone_porta:
+			hits = np.flatnonzero((semitones*32).astype(np.int64) == self.target_semitone*32)
+			if hits.size:
+				# snapped onto the target; carry on from there without the portamento
+				self.tone_porta_lerp = 0
+				self.is_tone_porta   = False
+				steps = np.full(sample_count - hits[0], note_step)
+				steps[0] = self.target_semitone
+				semitone = self.target_semitone if steps.size == 1 else float(np.add.accumulate(steps)[-1])
+
+		self.semitone = semitone
+
+		# step volume slides, clamped after every sample
+
+		volume_step  = self.vol_slide_amount/(mix_rate/fps)
+		step_volumes = np.empty(sample_count)
+		step_volume  = self.step_volume
+		i = 0
+
+		while i < sample_count:
+
+			steps = np.full(sample_count-i + 1, volume_step)
+			steps[0] = step_volume
+			run = np.add.accumulate(steps)[1:]
+
+			hits = np.flatnonzero((run > 255) | (run < 0))
+			if not hits.size:
+				step_volumes[i:] = run
+				step_volume = float(run[-1])
+				break
+
+			k = hits[0]
+			step_volumes[i:i+k+1] = run[:k+1]
+			step_volume = clamp(0, 255, float(run[k]))
+			i += k+1
 
-		def tick_self():
+			if not (0 <= step_volume+volume_step <= 255):
+				# stuck against the limit for the rest of the tick
+				step_volumes[i:] = step_volume+volume_step
+				break
 
-			# note
+		self.step_volume = step_volume
 
-			cur_perf_row = self.perf_row_buffer[self.perf_row_idx]
+		return step_volumes
 
-			if cur_perf_row["note"] not in [0, None]:
 
-				if reset_volume: # emulates GAX v3.05
-					self.perf_row_volume = 255
+	def wrap_wave_position(self, position, wave_length, wave_loop, play_once):
 
-				# else this emulates GAX v3.03a and lower.
+		# the looping / clamping part of the per-sample loop in tick_audio
 
-				# old_perf_semitone and perf_pitch are called twice.
-				# i don't know if this is ideal, but optimizing this
-				# breaks the phase reset of the perf list
+		if not play_once:
 
-				if not cur_perf_row["fixed"]:
-					self.old_perf_semitone = self.perf_semitone
-					self.perf_semitone     = cur_perf_row["note"] - 4 # apply note correction since
-					self.perf_pitch        = self.perf_semitone * 32  # set that as our perf pitch
-					self.is_fixed          = False
+			if position > wave_loop.upper_bound:
+				if wave_loop.ping_pong:
+					self.wave_direction = -1
 				else:
-					self.old_perf_semitone = self.perf_semitone
-					self.perf_semitone     = cur_perf_row["note"] - 2
-					self.perf_pitch        = self.perf_semitone * 32
-					self.is_fixed          = True
+					position -= wave_loop.loop_end - wave_loop.loop_start
 
+			if position <= wave_loop.lower_bound:
+				if wave_loop.ping_pong:
+					self.wave_direction = 1
 
-			# wave slot idx
-			if cur_perf_row["wave_slot_id"] > 0 and cur_perf_row["note"] not in [0, None]:
-				# if the wave slot isn't empty
-				self.wave_idx = self.instrument_data.header["wave_slots"][
-					cur_perf_row["wave_slot_id"] - 1]
-				try:
-					self.wave_params = self.instrument_data.wave_params[cur_perf_row["wave_slot_id"] - 1]
-				except:
-					pass
+		if position >= wave_length:
+			position = wave_length - 1
+		elif position < 0:
+			position = 0
+
+		return position
+
+
+	def render_positions(self, sample_count, wave_length, wave_loop, play_once):
+
+		# the wave position only needs the scalar code on samples that wrap,
+		# bounce or clamp. everything in between is a plain running sum.
+
+		positions  = np.empty(sample_count)
+		directions = np.empty(sample_count, dtype=np.int8)
+		position   = self.wave_position
+		seen       = dict() # position + direction after each wrap, to spot cycles
+		scalar_run = 0
+		i = 0
+
+		while i < sample_count:
+
+			if scalar_run:
+				# the wraps are too close together for numpy to pay off
+				end = min(i+scalar_run, sample_count)
+				while i < end:
+					position = self.wrap_wave_position(position + self.wave_step_rate*self.wave_direction,
+													   wave_length, wave_loop, play_once)
+					positions[i]  = position
+					directions[i] = self.wave_direction
+					i += 1
+				scalar_run = 0
+				continue
+
+			direction = self.wave_direction
+
+			steps = np.full(sample_count-i + 1, self.wave_step_rate*direction)
+			steps[0] = position
+			run = np.add.accumulate(steps)[1:]
+
+			events = (run >= wave_length) | (run < 0)
+			if not play_once:
+				if not wave_loop.ping_pong:
+					events |= run > wave_loop.upper_bound
+				else:
+					if direction != -1:
+						events |= run > wave_loop.upper_bound
+					if direction != 1:
+						events |= run <= wave_loop.lower_bound
+
+			hits = np.flatnonzero(events)
+			if not hits.size:
+				positions[i:]  = run
+				directions[i:] = direction
+				position = float(run[-1])
+				break
+
+			k = hits[0]
+			positions[i:i+k]  = run[:k]
+			directions[i:i+k] = direction
+
+			position = self.wrap_wave_position(float(run[k]), wave_length, wave_loop, play_once)
+			positions[i+k]  = position
+			directions[i+k] = self.wave_direction
+			i += k+1
+
+			state = (position, self.wave_direction)
+			if state in seen:
+				# back where an earlier wrap left us (e.g. a one-shot sample parked
+				# on its last byte), so the rest of the tick repeats that stretch
+				period = i - seen[state]
+				repeats = -(-(sample_count-i) // period)
+				positions[i:]  = np.tile(positions[i-period:i], repeats)[:sample_count-i]
+				directions[i:] = np.tile(directions[i-period:i], repeats)[:sample_count-i]
+				position = float(positions[-1])
+				self.wave_direction = int(directions[-1])
+				break
+			seen[state] = i
+
+			if k < 8:
+				scalar_run = 64
+
+		self.wave_position = position
+
+		return positions
+
+
+	def render_modulator(self, sample_count, wave_loop, play_once):
+
+		# same idea as render_positions: the modulo only does anything on wraparound
+
+		subpositions = np.empty(sample_count)
+		subposition  = self.modulate_subposition
+		seen         = dict()
+		scalar_run   = 0
+		i = 0
+
+		while i < sample_count:
+
+			if scalar_run:
+				end = min(i+scalar_run, sample_count)
+				while i < end:
+					subposition = (subposition + self.modulate_step_rate) % self.modulate_size
+					subpositions[i] = subposition
+					i += 1
+				scalar_run = 0
+				continue
+
+			steps = np.full(sample_count-i + 1, self.modulate_step_rate)
+			steps[0] = subposition
+			run = np.add.accumulate(steps)[1:]
+
+			hits = np.flatnonzero((run >= self.modulate_size) | (run < 0))
+			if not hits.size:
+				subpositions[i:] = run
+				subposition = float(run[-1])
+				break
+
+			k = hits[0]
+			subpositions[i:i+k] = run[:k]
+
+			subposition = float(run[k]) % self.modulate_size
+			subpositions[i+k] = subposition
+			i += k+1
+
+			if subposition in seen:
+				period  = i - seen[subposition]
+				repeats = -(-(sample_count-i) // period)
+				subpositions[i:] = np.tile(subpositions[i-period:i], repeats)[:sample_count-i]
+				subposition = float(subpositions[-1])
+				break
+			seen[subposition] = i
+
+			if k < 8:
+				scalar_run = 64
+
+		self.modulate_subposition = subposition
+
+		final_positions = (self.modulate_position + subpositions) + wave_loop.start_position
+		self.modulate_final_pos = float(final_positions[-1])
+
+		if not play_once:
+			backwards = final_positions > wave_loop.loop_end-1
+			forwards  = final_positions < wave_loop.loop_start
+			turns = np.flatnonzero(backwards | forwards)
+			if turns.size:
+				self.modulate_direction = 1 if forwards[turns[-1]] else -1
+
+		return final_positions
+
+
+	def control_tick_block(self, sample_count, mix_rate, fps):
+
+		# NumPy version of control_tick
+
+		env_volumes  = self.render_volenv(sample_count)
+		step_volumes = self.render_slides(sample_count, mix_rate, fps)
+
+		# apply volume transformations
+		return ((((self.perf_row_volume/255) * step_volumes)/255) * env_volumes)/255
+
+
+	def tick_audio_block(self, mix_rate, sample_bank, stream, fps=60, gain=1, debug=False, pitch_table=None):
+
+		'''
+		NumPy version of tick_audio. Renders the whole tick in one go,
+		sample-identical to the per-sample loop.
+		'''
+
+		play_once, is_invalid_loop = self.calc_step_rate(mix_rate, pitch_table)
+		sample_count = int(mix_rate/fps)
+
+		if self.wave_idx >= sample_bank.count or sample_count <= 0: # accurate GAX behavior
+			self.output_buffer = np.zeros(0)
+			self.tick_modulators()
+			return
+
+		wave_data   = sample_bank.arrays[self.wave_idx] # already signed
+		wave_length = sample_bank.lengths[self.wave_idx]
+		wave_loop   = sample_bank.get_loop(self.wave_idx, self.wave_params)
+
+		if wave_length == 0 and (self.is_modulate or self.wave_idx != 0):
+			# empty sample that's still being read from; leave this to the scalar loop
+			return self.tick_audio(mix_rate, sample_bank, stream, fps=fps, gain=gain, debug=debug, pitch_table=pitch_table)
+		if self.is_modulate and self.modulate_size == 0:
+			return self.tick_audio(mix_rate, sample_bank, stream, fps=fps, gain=gain, debug=debug, pitch_table=pitch_table)
+
+		## control stage
+		factors = self.control_tick_block(sample_count, mix_rate, fps)
+
+		## audio stage: read through the waveform data
+
+		if self.is_modulate:
+			indices = self.render_modulator(sample_count, wave_loop, play_once).astype(np.int64)
+		elif wave_length > 0:
+			indices = self.render_positions(sample_count, wave_length, wave_loop, play_once).astype(np.int64)
+		else:
+			# don't attempt to read from an empty sample
+			self.wave_position     = 0
+			self.modulate_position = 0
+			indices = None
+
+		mix_gain = gain * self.mix_volume
+
+		valid = None
+		if self.wave_idx != 0 and indices is not None:
+			valid = (indices >= -wave_length) & (indices < wave_length)
+
+		if valid is not None and valid.all():
+			output = (wave_data[indices] * factors) * mix_gain
+
+		elif valid is None:
+			# nothing gets read, so the previous output keeps getting scaled down
+			steps = np.empty(sample_count*2 + 1)
+			steps[0]    = self.wave_output
+			steps[1::2] = factors
+			steps[2::2] = mix_gain
+			output = np.multiply.accumulate(steps)[2::2]
+
+		else:
+			# out of range modulator reads hold the previous output
+			samples = wave_data[np.where(valid, indices, 0)]
+			output  = np.empty(sample_count)
+			wave_output = self.wave_output
+			for i in range(sample_count):
+				if valid[i]:
+					wave_output = int(samples[i])
+				wave_output *= factors[i]
+				wave_output *= mix_gain
+				output[i] = wave_output
+
+		self.wave_output   = float(output[-1])
+		self.output_buffer = output
+
+		self.tick_modulators()
+
+
+	## fixed-point renderer
+	# integer version of tick_audio_block, see gax_fixed. the wave position and modulator
+	# subposition are kept as floats between ticks (always whole multiples of 1/65536, so
+	# they convert back and forth exactly); the slides and the envelope run as usual.
+
+	def tick_audio_fixed(self, mix_rate, sample_bank, stream, fps=60, gain=1, debug=False, pitch_table=None):
+
+		play_once, is_invalid_loop = self.calc_step_rate(mix_rate, pitch_table, fixed=True)
+		sample_count = int(mix_rate/fps)
 
-			# clamping of the volume
-			if self.perf_row_volume > 255:
+		if self.wave_idx >= sample_bank.count or sample_count <= 0: # accurate GAX behavior
+			self.output_buffer = np.zeros(0, dtype=np.int64)
+			self.tick_modulators()
+			return
+
+		wave_data   = sample_bank.arrays[self.wave_idx] # already signed
+		wave_length = sample_bank.lengths[self.wave_idx]
+		wave_loop   = sample_bank.get_loop(self.wave_idx, self.wave_params)
+
+		if (wave_length == 0 and (self.is_modulate or self.wave_idx != 0)) or (self.is_modulate and self.modulate_size == 0):
+			# the odd cases tick_audio_block leaves to the scalar loop too
+			return self.tick_audio(mix_rate, sample_bank, stream, fps=fps, gain=gain, debug=debug, pitch_table=pitch_table)
+
+		## control stage: 8-bit volume per sample
+		volumes = get_fixed_volumes(self.perf_row_volume,
+			self.render_slides(sample_count, mix_rate, fps), self.render_volenv(sample_count))
+
+		## audio stage
+		if self.is_modulate:
+			positions, subposition, self.modulate_direction = render_fixed_modulator(
+				to_fixed(self.modulate_subposition), self.modulate_position, wave_loop.start_position,
+				self.modulate_step_rate, self.modulate_size, sample_count,
+				wave_loop.loop_start, wave_loop.loop_end, self.modulate_direction, play_once)
+			self.modulate_subposition = subposition / fixed_one
+			self.modulate_final_pos   = int(positions[-1]) / fixed_one
+			indices = positions >> 16
+		elif wave_length > 0:
+			positions, position, self.wave_direction = render_fixed_positions(
+				to_fixed(self.wave_position), self.wave_direction, self.wave_step_rate, sample_count, wave_length,
+				wave_loop.upper_bound, wave_loop.lower_bound, wave_loop.loop_end - wave_loop.loop_start,
+				wave_loop.ping_pong, play_once)
+			self.wave_position = position / fixed_one
+			indices = positions >> 16
+		else:
+			# don't attempt to read from an empty sample
+			self.wave_position     = 0
+			self.modulate_position = 0
+			indices = None
+
+		samples = None
+		valid   = None
+		if self.wave_idx != 0 and indices is not None:
+			valid   = (indices >= -wave_length) & (indices < wave_length)
+			samples = wave_data[np.where(valid, indices, 0)]
+
+		# 8.8 channel gain
+		self.output_buffer, self.wave_output = render_fixed_output(samples, valid, volumes,
+			to_fixed(gain * self.mix_volume) >> 8, int(self.wave_output))
+
+		self.tick_modulators()
+
+
+	def run_perf_row(self, reset_volume=True):
+
+		'''
+		Runs the current perf list row. The rows are compiled with the instrument
+		(see gax_instrument.perf_row_program), so this only applies what's already been worked out.
+		'''
+
+		cur_perf_row = self.perf_row_buffer[self.perf_row_idx]
+
+		# note
+
+		if cur_perf_row.has_note:
+
+			if reset_volume: # emulates GAX v3.05
 				self.perf_row_volume = 255
-			elif self.perf_row_volume < 0:
-				self.perf_row_volume = 0
-			
-			self.perf_row_idx += 1
 
-			if not self.perf_list_end:
-				if cur_perf_row["note"] not in [0, None]:
-					try:
-						if cur_perf_row["wave_slot_id"] > 0:
-							self.wave_position = self.wave_params["start_position"]
-					except:
-						# do not attempt to read non-existant wave position
-						pass
+			# else this emulates GAX v3.03a and lower.
 
-			if self.perf_row_idx >= len(self.perf_row_buffer):
-				# the perf list actually doesn't loop on its own; you have to make it loop manually
-				self.perf_row_idx -= 1
-				self.perf_list_end = True
+			self.old_perf_semitone = self.perf_semitone
+			self.perf_semitone     = cur_perf_row.note_semitone # note correction already applied
+			self.perf_pitch        = self.perf_semitone * 32    # set that as our perf pitch
+			self.is_fixed          = cur_perf_row.fixed
 
+			# wave slot idx
+			if cur_perf_row.sets_wave:
+				# if the wave slot isn't empty
+				if cur_perf_row.wave_idx == None:
+					raise IndexError("perf list row uses wave slot {}, which doesn't exist".format(cur_perf_row.wave_slot_id))
+				self.wave_idx = cur_perf_row.wave_idx
+				if cur_perf_row.has_wave_params:
+					self.wave_params = cur_perf_row.wave_params
 
-			# effects
+		# clamping of the volume
+		if self.perf_row_volume > 255:
+			self.perf_row_volume = 255
+		elif self.perf_row_volume < 0:
+			self.perf_row_volume = 0
 
-			for column in cur_perf_row["effect"]:
+		self.perf_row_idx += 1
 
-				fx_column = list(reversed(column))
+		if not self.perf_list_end:
+			if cur_perf_row.sets_wave and self.wave_params != None:
+				self.wave_position = self.wave_params.start_position
 
-				if fx_column[0] == gax.perf_row_effect.pitch_slide_up:
-					self.perf_note_slide_amount = fx_column[1]
+		if self.perf_row_idx >= len(self.perf_row_buffer):
+			# the perf list actually doesn't loop on its own; you have to make it loop manually
+			self.perf_row_idx -= 1
+			self.perf_list_end = True
 
-				if fx_column[0] == gax.perf_row_effect.pitch_slide_down:
-					self.perf_note_slide_amount = -fx_column[1]
 
-				if fx_column[0] == gax.perf_row_effect.jump_to_row:
-					self.perf_row_idx = fx_column[1]
-					self.perf_list_end = False
+		# effects
 
-				# to do: jump delay does nothing.
+		for opcode, param in cur_perf_row.ops:
+
+			if opcode == op_pitch_slide:
+				self.perf_note_slide_amount = param
 
-				if fx_column[0] == gax.perf_row_effect.jump_delay:
-					if self.perf_row_delay == 0:
-						self.perf_row_idx = fx_column[1]
-					else:
-						self.perf_row_delay -= 1
+			elif opcode == op_volume_slide:
+				self.perf_vol_slide_amount = param
 
-				if fx_column[0] == gax.perf_row_effect.volume_slide_up:
-					self.perf_vol_slide_amount = fx_column[1]
+			elif opcode == op_jump:
+				self.perf_row_idx = param
+				self.perf_list_end = False
 
-				if fx_column[0] == gax.perf_row_effect.volume_slide_down:
-					self.perf_vol_slide_amount = -fx_column[1]	
+			elif opcode == op_jump_delay:
+				# to do: jump delay does nothing.
+				if self.perf_row_delay == 0:
+					self.perf_row_idx = param
+				else:
+					self.perf_row_delay -= 1
 
-				if fx_column[0] == gax.perf_row_effect.set_volume:
-					self.perf_row_volume = fx_column[1]
+			elif opcode == op_set_volume:
+				self.perf_row_volume = param
 
-				if fx_column[0] == gax.perf_row_effect.set_speed:
-					self.perf_row_speed = fx_column[1]
+			elif opcode == op_set_speed:
+				self.perf_row_speed = param
 
 
+	def tick_perf_list(self, wave_bank, reset_volume=True):
+
 		# slide functions
 		self.perf_pitch      += self.perf_note_slide_amount  # the pitch of the note (affected by perf list porta effects)
 		self.perf_semitone    = self.perf_pitch / 32         # the "normalized" semitone
@@ -551,7 +1028,7 @@ class channel:
 			if self.perf_row_timer % self.perf_row_speed == 0:
 				self.perf_note_slide_amount = 0 # don't apply pitch slides if there are none
 				self.perf_vol_slide_amount  = 0
-				tick_self()
+				self.run_perf_row(reset_volume)
 
 
 		if len(self.perf_row_buffer) > 1:
@@ -562,18 +1039,29 @@ class channel:
 
 	def tick(self, channel, replayer, instrument_set, 
 		wave_bank, stream, mixing_rate = 15769, fps=60, gain=1,
-		major_version=3, minor_version=5):
+		major_version=3, minor_version=5, perf_state=None):
+
+		# perf_state: this tick's perf list output, taken from a control log (see gax_control_log)
+		# instead of running the perf list
+
+		# these can be the prepared banks (what the replayer passes in) or the raw lists from the module
+		if not isinstance(wave_bank, sample_bank):
+			wave_bank = get_sample_bank(wave_bank, replayer)
+		if not isinstance(instrument_set, instrument_bank):
+			instrument_set = get_instrument_bank(instrument_set, replayer)
 
 		if self.instrument_data != None:
 
 			if self.timer == 0 and self.volenv_has_looped == False:
 				# start from defined wave position
 				try:
-					self.wave_position = self.instrument_data.wave_params[self.perf_row_buffer[self.perf_row_idx]["wave_slot_id"] - 1]["start_position"]
+					self.wave_position = self.instrument_data.wave_params[self.perf_row_buffer[self.perf_row_idx].wave_slot_id - 1].start_position
 				except:
 					self.wave_position = 0 # correct if possible
 
-			if major_version > 2:
+			if perf_state != None:
+				self.set_perf_state(perf_state)
+			elif major_version > 2:
 				if minor_version > 3:
 					self.tick_perf_list(wave_bank)
 				else:
@@ -581,16 +1069,35 @@ class channel:
 			else:
 				self.tick_perf_list(wave_bank, reset_volume=False)
 			
+			if replayer != None and replayer.engine == "numpy":
+				tick_audio = self.tick_audio_block
+			elif replayer != None and replayer.engine == "fixed":
+				tick_audio = self.tick_audio_fixed
+			else:
+				tick_audio = self.tick_audio
+
 			if replayer != None:
-				self.tick_audio(mixing_rate, wave_bank, stream, fps=fps, gain=gain*(replayer.mix_amp/512), debug=True)
+				tick_audio(mixing_rate, wave_bank, stream, fps=fps, gain=gain*(replayer.mix_amp/512), debug=True,
+						   pitch_table=replayer.pitch_table)
 			else:
-				self.tick_audio(mixing_rate, wave_bank, stream, fps=fps, gain=gain, debug=True)
+				tick_audio(mixing_rate, wave_bank, stream, fps=fps, gain=gain, debug=True)
 
 		else:
 			# render silence
-			self.output_buffer = list(0 for i in range(int(mixing_rate/fps)))
-		
+			if replayer != None and replayer.engine in numpy_engines:
+				self.output_buffer = np.zeros(int(mixing_rate/fps))
+			else:
+				self.output_buffer = list(0 for i in range(int(mixing_rate/fps)))
 		
+		self.end_tick(channel, replayer, instrument_set)
+
+		self.volenv_cur_vol += self.volenv_lerp
+
+
+	def end_tick(self, channel, replayer, instrument_set):
+
+		# the timers and the delayed notes, after the channel's audio for this tick
+
 		if not self.delay_finished:
 			self.delay_timer += 1
 
@@ -606,11 +1113,58 @@ class channel:
 		except:
 			pass
 
-		self.volenv_cur_vol += self.volenv_lerp
+
+	## control logs
+	# the perf list only depends on the notes and instruments, not on the mixing rate, so its
+	# output can be recorded once and replayed at any rate (see gax_control_log)
+
+	def tick_control(self, channel, replayer, instrument_set, wave_bank, major_version=3, minor_version=5):
+
+		'''
+		The part of tick that doesn't depend on the mixing rate: the perf list and the note delay.
+		Nothing gets rendered, so the audio state (slides, envelope, positions) is left behind.
+		Returns the perf list's output for this tick (see get_perf_state), or None without an instrument.
+		'''
+
+		perf_state = None
+
+		if self.instrument_data != None:
+			# only the perf list sets it from here, so this tells whether it did
+			self.wave_position = None
+
+			if major_version > 2 and minor_version > 3:
+				self.tick_perf_list(wave_bank)
+			else:
+				self.tick_perf_list(wave_bank, reset_volume=False)
+
+			perf_state = self.get_perf_state()
+
+		self.end_tick(channel, replayer, instrument_set)
+
+		return perf_state
+
+
+	def get_perf_state(self):
+		# what the audio reads of the perf list: pitch, volume, waveform and a wave position reset
+		return (self.perf_semitone, self.perf_row_volume, self.is_fixed, self.wave_idx, self.wave_params,
+				self.wave_position != None)
+
+
+	def set_perf_state(self, perf_state):
+
+		(self.perf_semitone, self.perf_row_volume, self.is_fixed, self.wave_idx, self.wave_params,
+		 reset_position) = perf_state
+
+		if reset_position:
+			self.wave_position = self.wave_params.start_position
 
 
 	def init_instr(self, instrument_set, instr_idx=1, semitone=0x31):
 
+		# compiling here would happen on every note, so this one only takes a compiled bank
+		if not isinstance(instrument_set, instrument_bank):
+			raise Exception("init_instr needs a compiled instrument_bank (see get_instrument_bank)")
+
 		if instr_idx < len(instrument_set):
 
 			self.volenv_timer       = 0
@@ -632,7 +1186,7 @@ class channel:
 				self.instrument_idx  = instr_idx
 				self.volenv_pause    = False
 				self.timer           = 0 # reset timer
-				self.instrument_data = instrument_set[instr_idx] # get the required data
+				self.instrument_data = instrument_set[instr_idx] # get the required (compiled) data
 				self.is_active       = True # let the replayer know this channel is active
 
 				self.use_vibrato            = False 
@@ -643,27 +1197,22 @@ class channel:
 				
 				self.perf_semitone   = 0
 				self.perf_row_idx    = 0
-				self.perf_row_speed  = self.instrument_data.perf_list["perf_row_speed"]
-				self.perf_row_buffer = self.instrument_data.perf_list["perf_list_data"]
+				self.perf_row_speed  = self.instrument_data.perf_row_speed
+				self.perf_row_buffer = self.instrument_data.perf_rows
 				self.perf_row_timer  = 0
 				self.perf_row_volume = 255
 
 				self.is_fixed = False
 
-				self.volenv_buffer = list(list(i) for i in self.instrument_data.volume_envelope["points"])
+				self.volenv_buffer = self.instrument_data.volenv_points # read-only, so it can be shared
 				self.volenv_idx    = 0
 				self.volenv_lerp   = 0
 				self.volenv_loop   = False
 				self.volenv_end    = False
 
-				try:
-					self.volenv_pause_point = self.instrument_data.volume_envelope["sustain_point"]
-				except:
-					self.volenv_pause_point = None
+				self.volenv_pause_point = self.instrument_data.volenv_sustain_point
 
-				vibrato_params = self.instrument_data.header['vibrato_params']
-
-				if (vibrato_params['vibrato_wait'] == 0 and vibrato_params['vibrato_depth'] == 0 and vibrato_params['vibrato_speed'] == 0):
+				if not self.instrument_data.use_vibrato:
 					self.use_vibrato   = False
 					self.is_vibrato    = False
 					self.vibrato_init  = 0
@@ -672,19 +1221,19 @@ class channel:
 				else:
 					self.use_vibrato      = True
 					self.is_vibrato       = False
-					self.vibrato_init     = vibrato_params['vibrato_wait']
-					self.vibrato_depth    = vibrato_params['vibrato_depth']
-					self.vibrato_speed    = vibrato_params['vibrato_speed']
+					self.vibrato_init     = self.instrument_data.vibrato_wait
+					self.vibrato_depth    = self.instrument_data.vibrato_depth
+					self.vibrato_speed    = self.instrument_data.vibrato_speed
 					self.vibrato_timer    = 0
 					self.vibrato_subtimer = 0
 
-					if vibrato_params['vibrato_wait'] == 0:
+					if self.instrument_data.vibrato_wait == 0:
 						self.is_vibrato = True
 
 
 				# load the necessary wave params
 				try:
-					self.wave_params = self.instrument_data.wave_params[self.perf_row_buffer[self.perf_row_idx]["wave_slot_id"] - 1]
+					self.wave_params = self.instrument_data.wave_params[self.perf_row_buffer[self.perf_row_idx].wave_slot_id - 1]
 				except:
 					pass # don't attempt to read an empty wave parameter
 					# mitigates crashing in American Dragon Jake Long
@@ -692,12 +1241,43 @@ class channel:
 
 
 
+class replayer_snapshot:
+
+	'''
+	Saved replayer state, see replayer.get_snapshot. Only plain values, tuples and the
+	step commands of the last row read, so it's cheap to keep around and can be pickled.
+	'''
+
+	__slots__ = ("timer", "speed", "speed_timer", "cur_step", "cur_pat", "loop_count", "skip",
+				 "cur_step_data", "channels")
+
+	def __init__(self, **fields):
+		for name, value in fields.items():
+			setattr(self, name, value)
+
+
 class replayer():
 
 
-	def __init__(self, gax_obj, song_idx = 0, allocate_fxch = False, fx_obj = None):
+	def __init__(self, gax_obj, song_idx = 0, allocate_fxch = False, fx_obj = None, engine = None, output_format = "int8"):
 
 		self.gax_data = gax_obj
+
+		# what mix_tick puts out, one of output_formats
+		if output_format not in output_formats:
+			raise ValueError("Unknown output format: {}".format(output_format))
+		self.output_format = output_format
+
+		# "numpy" renders a whole tick per channel at once, "python" goes sample by sample.
+		# both produce the same output. "fixed" renders with integer fixed-point math like
+		# the GBA does (see gax_fixed), so its output differs slightly from the other two
+		if engine == None:
+			engine = "python" if np == None else "numpy"
+		if engine not in ["python", "numpy", "fixed"]:
+			raise ValueError("Unknown replayer engine: {}".format(engine))
+		if engine in numpy_engines and np == None:
+			raise Exception("The {} engine requires NumPy to be installed".format(engine))
+		self.engine = engine
 		self.song_data = self.gax_data.get_song_data(song_idx)
 
 		if allocate_fxch == True:
@@ -715,7 +1295,10 @@ class replayer():
 		self.loop_count = 0     # for audio export
 		self.skip       = False # True if a pattern break is read
 
-		self.cur_pat_data = get_patterns_at_idx(self.song_data, self.cur_pat) # get the first patterns
+		self.music_paused = False # GAX_pause_music: the sequencer and music channels stand still
+
+		# the song's rows as flat event lists, see gax_timeline
+		self.timeline = song_timeline(self.song_data)
 
 		self.step_count    = self.song_data.get_properties().step_count
 		self.pattern_count = self.song_data.get_properties().song_length
@@ -741,107 +1324,210 @@ class replayer():
 
 		self.output_buffer = ''
 
+		# step rates for every 1/32 semitone, shared by the music and FX channels
+		self.pitch_table = pitch_table()
 
+		# compiled instruments and signed waveforms + loop settings, built once and shared by every channel
+		self.instruments = instrument_bank(self.gax_data.instrument_set)
+		self.sample_bank = sample_bank(self.gax_data.wave_set.wave_bank, self.instruments,
+									   use_numpy=(self.engine in numpy_engines))
+		if allocate_fxch:
+			self.fx_instruments = instrument_bank(self.fx_data.instrument_set)
+			self.fx_sample_bank = sample_bank(self.fx_data.wave_set.wave_bank, self.fx_instruments,
+											  use_numpy=(self.engine in numpy_engines))
+		else:
+			self.fx_instruments = None
+			self.fx_sample_bank = None
 
+		# banks for raw lists passed to channel.tick that aren't this replayer's own (see get_sample_bank)
+		self.foreign_instruments  = dict()
+		self.foreign_sample_banks = dict()
 
-	def read_step_at_ch(self, channel):
+		if self.engine in numpy_engines:
+			# mixing buffers, reused every tick and grown when needed
+			self.mix_accumulator = np.zeros(0)
+			self.mix_rounded     = np.zeros(0)
+			self.mix_quantized   = np.zeros(0, dtype=np.int8)
+			self.mix_buffer      = self.mix_accumulator
 
-		step_data = self.cur_step_data[channel]
 
-		self.channels[channel].note_slide_amount = 0 # don't apply pitch slides if there are none
-		self.channels[channel].vol_slide_amount  = 0 # same for volume slides
 
-		if step_data != 0: # do this only if the step data is *not* an empty step
 
-			if step_data.semitone > 1:
+	def get_channel_bank(self, ch):
+		# the compiled instruments a channel plays from
+		if ch < self.num_channels:
+			return self.instruments
+		return self.fx_instruments
 
-				self.channels[channel].target_semitone = step_data.semitone+self.cur_pat_data[channel][1]
 
-				if (step_data.effect_type.value == 0xe
-					and (step_data.effect_param >> 4) == 0xd):
-					self.channels[channel].delay_tick_count = step_data.effect_param & 0x0f
-					self.channels[channel].delay_timer = 0
-					self.channels[channel].delay_finished = False
-				else:
-					self.channels[channel].delay_finished = True
-					self.channels[channel].init_instr(self.gax_data.instrument_set, instr_idx=step_data.instrument, semitone=self.channels[channel].target_semitone)
+	def get_snapshot(self):
 
-				# if a set volume command is not present:
+		'''
+		The whole playback state (sequencer + every music and FX channel) as plain data,
+		taken between two ticks. Restore it with restore_snapshot, on this replayer or on
+		another one playing the same song with the same FX setup.
+		'''
 
-				# only reset the volume if there isn't a tone portamento
-				# fixes Iridion II ~ 16: tenshi plains
+		return replayer_snapshot(
+			timer         = self.timer,
+			speed         = tuple(self.speed),
+			speed_timer   = self.speed_timer,
+			cur_step      = self.cur_step,
+			cur_pat       = self.cur_pat,
+			loop_count    = self.loop_count,
+			skip          = self.skip,
+			cur_step_data = tuple(self.cur_step_data),
+			channels      = tuple(self.channels[ch].get_state(self.get_channel_bank(ch))
+								  for ch in range(len(self.channels)))
+		)
 
-				if step_data.instrument != 0:
-					self.channels[channel].step_volume = 255
-					# also turn off the tone portamento
-					# fixes the SpongeBob SquarePants theme
-					self.channels[channel].is_tone_porta = False
-					self.channels[channel].tone_porta_lerp = 0
 
+	def restore_snapshot(self, snapshot):
 
-			if step_data.semitone == 1:
-				self.channels[channel].volenv_note_off = True
+		if len(snapshot.channels) != len(self.channels):
+			raise Exception("The snapshot has {} channels, but this replayer has {}".format(len(snapshot.channels), len(self.channels)))
 
+		self.timer         = snapshot.timer
+		self.speed         = list(snapshot.speed)
+		self.speed_timer   = snapshot.speed_timer
+		self.cur_step      = snapshot.cur_step
+		self.cur_pat       = snapshot.cur_pat
+		self.loop_count    = snapshot.loop_count
+		self.skip          = snapshot.skip
+		self.cur_step_data = list(snapshot.cur_step_data)
 
-			if step_data.effect_type.value > 0:
+		for ch in range(len(self.channels)):
+			self.channels[ch].set_state(snapshot.channels[ch], self.get_channel_bank(ch))
 
-				match step_data.effect_type.value: # preferrable to writing
-					                               # step_data.effect_type.value over and over
-					case 0x1: # pitch slide up
-						self.channels[channel].note_slide_amount = step_data.effect_param
 
-					case 0x2: # pitch slide down
-						self.channels[channel].note_slide_amount = -step_data.effect_param
+	def get_key(self):
 
+		'''
+		The current state for comparing with another one (e.g. at two loop points): everything
+		that decides the audio from here on. The tick and loop counters don't, and the channels
+		go by channel.get_key.
+		'''
 
-					case 0x3: # tone portamento
+		return (tuple(self.speed), self.speed_timer, self.cur_step, self.cur_pat, self.skip,
+				tuple(self.cur_step_data),
+				tuple(self.channels[ch].get_key(self.get_channel_bank(ch)) for ch in range(len(self.channels))))
 
-						new_semitone = self.channels[channel].semitone
 
-						if step_data.semitone == 0:
-							new_semitone = 0
-							self.channels[channel].target_semitone = new_semitone
+	def read_row(self, position, step):
 
-						try:
-							lerp = (new_semitone - self.channels[channel].old_semitone) / step_data.effect_param
-							self.channels[channel].tone_porta_lerp = lerp 
-						except:
-							self.channels[channel].tone_porta_lerp = 0
+		'''
+		Reads one row of the song timeline: every channel's slides get reset, then only
+		the channels that have something on this row get their step applied.
+		'''
 
-						self.channels[channel].is_tone_porta = True
-						self.channels[channel].semitone = self.channels[channel].old_semitone
+		timeline = self.timeline
 
+		for ch in range(self.num_channels):
+			self.channels[ch].note_slide_amount = 0 # don't apply pitch slides if there are none
+			self.channels[ch].vol_slide_amount  = 0 # same for volume slides
+			self.cur_step_data[ch] = timeline.empty_step
 
-					case 0x7: # speed modulation
-						self.speed = [step_data.effect_param & 0xf,
-									  step_data.effect_param >> 4]
+		for event in timeline.get_events(position, step):
+			ch = timeline.channel[event]
+			self.cur_step_data[ch] = timeline.steps[event]
+			self.read_step(ch, timeline.note[event], timeline.instrument[event],
+				timeline.effect[event], timeline.param[event], timeline.transpose[event])
 
-					case 0xA: # volume slide up
-						self.channels[channel].vol_slide_amount = step_data.effect_param
-					case 0xB: # volume slide down
-						self.channels[channel].vol_slide_amount = -step_data.effect_param
 
-					case 0xC: # set volume
-						self.channels[channel].step_volume = step_data.effect_param
+	def read_step(self, channel, semitone, instrument, effect, effect_param, transpose):
 
-					case 0xD: # break pattern
-						self.skip = True
-						# the param is ignored here
+		ch = self.channels[channel]
 
-					case 0xF: # set speed
-						self.speed = [step_data.effect_param]*2
+		if semitone > 1:
 
+			ch.target_semitone = semitone+transpose
+
+			if (effect == 0xe
+				and (effect_param >> 4) == 0xd):
+				ch.delay_tick_count = effect_param & 0x0f
+				ch.delay_timer = 0
+				ch.delay_finished = False
+			else:
+				ch.delay_finished = True
+				ch.init_instr(self.instruments, instr_idx=instrument, semitone=ch.target_semitone)
+
+			# if a set volume command is not present:
+
+			# only reset the volume if there isn't a tone portamento
+			# fixes Iridion II ~ 16: tenshi plains
+
+			if instrument != 0:
+				ch.step_volume = 255
+				# also turn off the tone portamento
+				# fixes the SpongeBob SquarePants theme
+				ch.is_tone_porta = False
+				ch.tone_porta_lerp = 0
+
+
+		if semitone == 1:
+			ch.volenv_note_off = True
+
+
+		if effect > 0:
+
+			match effect:
+				case 0x1: # pitch slide up
+					ch.note_slide_amount = effect_param
+
+				case 0x2: # pitch slide down
+					ch.note_slide_amount = -effect_param
+
+
+				case 0x3: # tone portamento
+
+					new_semitone = ch.semitone
+
+					if semitone == 0:
+						new_semitone = 0
+						ch.target_semitone = new_semitone
+
+					try:
+						lerp = (new_semitone - ch.old_semitone) / effect_param
+						ch.tone_porta_lerp = lerp 
+					except:
+						ch.tone_porta_lerp = 0
+
+					ch.is_tone_porta = True
+					ch.semitone = ch.old_semitone
+
+
+				case 0x7: # speed modulation
+					self.speed = [effect_param & 0xf,
+								  effect_param >> 4]
+
+				case 0xA: # volume slide up
+					ch.vol_slide_amount = effect_param
+				case 0xB: # volume slide down
+					ch.vol_slide_amount = -effect_param
+
+				case 0xC: # set volume
+					ch.step_volume = effect_param
+
+				case 0xD: # break pattern
+					self.skip = True
+					# the param is ignored here
+
+				case 0xF: # set speed
+					self.speed = [effect_param]*2
 
-	def tick(self, buffer, debug=False, export=False):
+
+	def tick_sequencer(self):
+
+		'''
+		The sequencer half of tick: timing, reading rows and moving through the order list.
+		Doesn't touch the channels' audio.
+		'''
 
 		self.timer += 1
 
 		if self.speed_timer <= 0 and self.speed[0] != 0: # read the pattern data
 
-			for i in range(0, self.num_channels):
-				note_real = self.song_data.get_patterns()[self.cur_pat_data[i][0]][self.cur_step]
-				self.cur_step_data[i] = note_real
-				self.read_step_at_ch(i)
+			self.read_row(self.cur_pat, self.cur_step)
 
 			self.cur_step += 1
 			self.speed = self.speed[::-1] # allow for speed modulation
@@ -858,15 +1544,39 @@ class replayer():
 				self.cur_pat = self.restart_pos
 				self.loop_count += 1
 
-			# update the current patterns to match
-			self.cur_pat_data = get_patterns_at_idx(self.song_data, self.cur_pat)
-		
+
+	def tick(self, buffer, debug=False, export=False):
+
+		if not self.music_paused:
+			self.tick_sequencer()
+		return self.mix_tick(buffer, debug=debug, export=export)
+
+
+	def mix_tick(self, buffer, debug=False, export=False):
+
+		# the mixing half of tick: mixes what the channels rendered this tick
+
 		if self.num_fx_channels != None:
 			num_ch = self.num_channels+self.num_fx_channels
 		else:
 			num_ch = self.num_channels
 
 
+		if self.engine in numpy_engines:
+			if self.output_format == "int8":
+				mix_buffer = self.mix_channels(num_ch).tobytes()
+			else:
+				# straight from the accumulator to the wider format, skipping the 8-bit mix
+				mix = self.sum_channels(num_ch)
+				mix_buffer = quantize(mix, len(mix), self.output_format)
+			# the tick's output in the output format, whichever path made it
+			self.output_buffer = mix_buffer
+			if not export:
+				buffer.write(mix_buffer)
+			if debug:
+				return mix_buffer
+			return
+
 		mix_buffer = list(0 for i in self.channels[0].output_buffer)
 
 		for i in range(0, num_ch):
@@ -885,7 +1595,10 @@ class replayer():
 				except:
 					pass
 
-		mix_buffer = bytes((x & 0xff for x in (list(clamp(-128, 127, round(i)) for i in mix_buffer))))
+		if self.output_format == "int8":
+			mix_buffer = bytes((x & 0xff for x in (list(clamp(-128, 127, round(i)) for i in mix_buffer))))
+		else:
+			mix_buffer = quantize(mix_buffer, len(mix_buffer), self.output_format)
 		self.output_buffer = list(x for x in mix_buffer)
 
 		if not export:
@@ -894,6 +1607,61 @@ class replayer():
 			return mix_buffer
 
 
+	def sum_channels(self, num_ch):
+
+		'''
+		Sums the channels into the mix accumulator and returns it (also kept in
+		self.mix_buffer). It's a view into a preallocated buffer, so it's only valid
+		until the next tick.
+		'''
+
+		# the first channel decides the length of the tick, like the old mixer did
+		sample_count = len(self.channels[0].output_buffer)
+
+		if sample_count > len(self.mix_accumulator):
+			self.mix_accumulator = np.zeros(sample_count)
+			self.mix_rounded     = np.zeros(sample_count)
+			self.mix_quantized   = np.zeros(sample_count, dtype=np.int8)
+
+		mix_buffer = self.mix_accumulator[:sample_count]
+		mix_buffer.fill(0)
+
+		for i in range(0, num_ch):
+			channel_buffer = self.channels[i].output_buffer
+			if len(channel_buffer) >= sample_count:
+				mix_buffer += channel_buffer[:sample_count]
+			else:
+				mix_buffer[:len(channel_buffer)] += channel_buffer
+
+		self.mix_buffer = mix_buffer
+		return mix_buffer
+
+
+	def mix_channels(self, num_ch):
+
+		'''
+		Sums the channels into the mix accumulator, then saturates and quantizes
+		the whole tick to 8-bit at once. The float mix stays in self.mix_buffer and
+		the unsigned 8-bit result in self.output_buffer; both are views into the
+		preallocated buffers, so they're only valid until the next tick.
+		'''
+
+		mix_buffer   = self.sum_channels(num_ch)
+		sample_count = len(mix_buffer)
+
+		# round half to even (same as round()), clamp, then wrap to unsigned bytes
+		rounded = self.mix_rounded[:sample_count]
+		np.rint(mix_buffer, out=rounded)
+		np.clip(rounded, -128, 127, out=rounded)
+
+		quantized = self.mix_quantized[:sample_count]
+		np.copyto(quantized, rounded, casting="unsafe")
+
+		self.output_buffer = quantized.view(np.uint8)
+
+		return self.output_buffer
+
+
 	def tick_channels(self, buffer, mixing_rate):
 
 		for i in range(self.num_channels):
@@ -910,7 +1678,7 @@ class replayer():
 		if self.num_channels+fxch >= len(self.channels):
 			raise Exception("Can't play SFX in an unallocated FX channel")
 
-		self.channels[self.num_channels+fxch].init_instr(self.fx_data.instrument_set, fx_idx)
+		self.channels[self.num_channels+fxch].init_instr(self.fx_instruments, fx_idx)
 
 	def stop_sound(self, fxch=0):
 
@@ -0,0 +1,160 @@
+from .gax_replayer import output_formats, quantize
+
+import math
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+'''
+Output-rate conversion for rendered songs.
+Rendering at 48khz makes every channel do three times the work it does at a song's own
+mixing rate (and isn't what the GBA did either). Instead, the song can be rendered at its
+own rate and the mix converted afterwards with a windowed-sinc polyphase filter.
+
+GAX rates like 15769hz don't divide evenly into 44.1/48khz, so instead of one filter phase per
+output position the filter is tabulated at a fixed number of phases and interpolated between them.
+'''
+
+
+# (taps, phases, passband) per quality; more taps = steeper filter, more phases = less interpolation error
+qualities = {
+	"fast":   (8,  64,   0.85),
+	"medium": (16, 256,  0.9),
+	"best":   (32, 1024, 0.95)
+}
+
+
+def make_filter_bank(taps, phases, cutoff):
+
+	'''
+	Kaiser-windowed sinc, one row of taps per phase (plus one extra row so phase+1 always exists).
+	Row p is for output points p/phases of the way between two input samples.
+	'''
+
+	half    = taps // 2
+	offsets = np.arange(-half+1, half+1)                 # input samples around the output point
+	fracs   = np.arange(phases+1)[:, None] / phases
+
+	distance = offsets[None, :] - fracs
+	window   = np.i0(8.0 * np.sqrt(np.clip(1 - (distance/half)**2, 0, 1))) / np.i0(8.0) # kaiser, beta 8
+
+	bank = cutoff * np.sinc(cutoff * distance) * window
+	bank /= bank.sum(axis=1, keepdims=True)              # unity gain at DC for every phase
+	return bank
+
+
+class resampler:
+
+	'''
+	Streaming rate converter. Feed it blocks of samples with process(), then call flush()
+	once at the end; the output has (input length * out_rate / in_rate) samples in total.
+	process_block()/flush_block() do the same for rendered PCM: input_format in, output_format out.
+	input_format is output_format by default; rendering as float64 instead means the mix
+	only gets quantized once, after the conversion.
+	'''
+
+	def __init__(self, in_rate, out_rate, quality="medium", output_format="int8", input_format=None):
+
+		if np == None:
+			raise Exception("Resampling requires NumPy to be installed")
+		if quality not in qualities:
+			raise ValueError("Unknown resampling quality: {}".format(quality))
+		if input_format == None:
+			input_format = output_format
+		for sample_format in (input_format, output_format):
+			if sample_format not in output_formats:
+				raise ValueError("Unknown output format: {}".format(sample_format))
+
+		gcd = math.gcd(int(in_rate), int(out_rate))
+		self.step_num = int(in_rate) // gcd  # the input advances step_num/step_den samples per output sample
+		self.step_den = int(out_rate) // gcd
+
+		taps, self.phases, passband = qualities[quality]
+		self.half = taps // 2
+		self.bank = make_filter_bank(taps, self.phases, min(1, out_rate/in_rate) * passband)
+
+		# to go back from PCM to the mixer's float scale
+		typecode, self.scale, self.offset = output_formats[input_format][:3]
+		self.output_format = output_format
+		self.dtype = np.dtype(typecode).newbyteorder("<")
+
+		self.history   = np.zeros(self.half - 1) # input samples before the current block
+		self.consumed  = 0                       # input samples dropped from the front so far
+		self.in_count  = 0
+		self.out_count = 0
+
+
+	def convert(self, samples, final=False):
+
+		buffer = np.concatenate((self.history, samples))
+		self.in_count += len(samples)
+
+		# output sample k sits at input position k*step_num/step_den
+		if final:
+			end = -(-self.in_count*self.step_den // self.step_num)
+			buffer = np.concatenate((buffer, np.zeros(self.half)))
+		else:
+			# only the points whose whole window is in already
+			available = max(0, self.in_count - self.half)
+			end = max(self.out_count, -(-available*self.step_den // self.step_num))
+
+		ks = np.arange(self.out_count, end, dtype=np.int64)
+		self.out_count = end
+
+		position = ks * self.step_num
+		index    = position // self.step_den
+		phase    = (position % self.step_den) * self.phases / self.step_den
+		row      = phase.astype(np.int64)
+		weight   = (phase - row)[:, None]
+
+		coefs = self.bank[row] * (1-weight) + self.bank[row+1] * weight
+
+		# buffer[0] is input sample (consumed - half + 1)
+		start   = index - self.consumed
+		windows = start[:, None] + np.arange(2*self.half)[None, :]
+		output  = (buffer[windows] * coefs).sum(axis=1)
+
+		# keep what the next points still need
+		keep_from = (self.out_count*self.step_num) // self.step_den - self.half + 1
+		drop = min(max(0, keep_from - (self.consumed - self.half + 1)), len(buffer))
+		self.history  = buffer[drop:]
+		self.consumed += drop
+
+		return output
+
+
+	def process(self, samples):
+		return self.convert(np.asarray(samples, dtype=np.float64))
+
+
+	def flush(self):
+		return self.convert(np.zeros(0), final=True)
+
+
+	# same, for PCM in and out
+	def process_block(self, block):
+		samples = (np.frombuffer(block, dtype=self.dtype) - self.offset) / self.scale
+		output  = self.process(samples)
+		return quantize(output, len(output), self.output_format)
+
+
+	def flush_block(self):
+		output = self.flush()
+		return quantize(output, len(output), self.output_format)
+
+
+def resample_ticks(blocks, in_rate, out_rate, quality="medium", output_format="int8", input_format=None):
+
+	'''
+	Takes rendered ticks (PCM in input_format, e.g. from offline_renderer.render_ticks) and
+	yields them converted to out_rate, in output_format. input_format is output_format by default.
+	'''
+
+	converter = resampler(in_rate, out_rate, quality, output_format, input_format)
+
+	for block in blocks:
+		yield converter.process_block(block)
+
+	yield converter.flush_block()
@@ -0,0 +1,126 @@
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+'''
+Prepared waveform data for the replayer.
+The raw wave bank holds unsigned bytes; the channels want signed samples,
+so the conversion is done once here instead of on every sample.
+'''
+
+
+class wave_loop:
+
+	'''
+	Loop settings for one waveform played with one set of (compiled) wave params,
+	already checked against the waveform's length.
+	'''
+
+	def __init__(self, wave_length, wave_params):
+
+		self.wave_length = wave_length
+
+		if wave_params != None:
+			self.start_position = wave_params.start_position
+			self.loop_start     = wave_params.loop_start
+			self.loop_end       = wave_params.loop_end
+			self.ping_pong      = wave_params.ping_pong
+
+			self.is_invalid_loop = wave_params.is_invalid_loop
+			self.play_once       = wave_params.play_once
+
+		else:
+			# no wave param handler
+			self.start_position = 0
+			self.loop_start     = 0
+			self.loop_end       = 0
+			self.ping_pong      = False
+
+			self.is_invalid_loop = False
+			self.play_once       = True
+
+		# the replayer wraps when it runs past the loop end *or* the end of the sample,
+		# and turns around at the loop start *or* the start of the sample.
+		# folding both into one bound each saves a comparison per sample
+		self.upper_bound = min(wave_length, self.loop_end)
+		self.lower_bound = max(0, self.loop_start)
+
+
+class sample_bank:
+
+	'''
+	Signed copies of every waveform in a wave bank, with their lengths and loop settings.
+	waves holds plain lists for the per-sample loop, arrays holds NumPy copies for the
+	block renderer (None without NumPy).
+
+	Options:
+		instruments: a compiled instrument_bank; pre-validates the loop settings of every instrument's wave slots.
+		use_numpy: also build the NumPy copies.
+
+	Build it once per wave bank (the replayer does this) and rebuild it after editing
+	waveforms or wave params.
+	'''
+
+	def __init__(self, wave_bank, instruments=None, use_numpy=True):
+
+		self.count   = len(wave_bank)
+		self.lengths = [len(wave) for wave in wave_bank]
+
+		self.waves = [[sample - 128 for sample in wave] for wave in wave_bank]
+
+		if use_numpy and np != None:
+			self.arrays = [np.array(wave, dtype=np.int64) for wave in self.waves]
+		else:
+			self.arrays = None
+
+		self.loops = dict()
+
+		if instruments != None:
+			for instr in instruments:
+				for wave_idx, wave_params in zip(instr.wave_slots, instr.wave_params):
+					if wave_idx < self.count:
+						self.get_loop(wave_idx, wave_params)
+
+
+	def __len__(self):
+		return self.count
+
+
+	def get_loop(self, wave_idx, wave_params):
+
+		# keyed on the wave params object itself, which is kept alive alongside its loop
+		key = (wave_idx, id(wave_params))
+
+		try:
+			return self.loops[key][1]
+		except KeyError:
+			loop = wave_loop(self.lengths[wave_idx], wave_params)
+			self.loops[key] = (wave_params, loop)
+			return loop
+
+
+def get_sample_bank(wave_bank, replayer=None):
+
+	'''
+	Returns a sample bank for a raw wave bank list, for callers that still pass the raw list around.
+	If it's one of replayer's own wave banks, that's the bank the replayer already built;
+	any other list gets built once and kept on the replayer, so it lives as long as the replayer does.
+	Without a replayer, it builds a new bank every call.
+	'''
+
+	if replayer == None:
+		return sample_bank(wave_bank)
+
+	if wave_bank is replayer.gax_data.wave_set.wave_bank:
+		return replayer.sample_bank
+	if replayer.fx_sample_bank != None and wave_bank is replayer.fx_data.wave_set.wave_bank:
+		return replayer.fx_sample_bank
+
+	# keyed on the list itself, which is kept alive alongside its bank
+	try:
+		return replayer.foreign_sample_banks[id(wave_bank)][1]
+	except KeyError:
+		bank = sample_bank(wave_bank, use_numpy=(replayer.sample_bank.arrays != None))
+		replayer.foreign_sample_banks[id(wave_bank)] = (wave_bank, bank)
+		return bank
@@ -0,0 +1,121 @@
+import collections
+
+'''
+Per-channel render cache for repeated pattern spans.
+A music channel's output for one order list position only depends on the state it enters
+the position with, the pattern + transpose it plays there and how the rows are timed
+(the sequencer doesn't depend on any channel). So when a channel plays the same pattern
+again from the same state with the same timing, its audio and the state it ends up in
+can be copied from last time instead of rendered.
+
+See offline_renderer.render_ticks(segment_cache=...).
+'''
+
+
+class segment_cache:
+
+	'''
+	LRU cache of rendered channel spans, limited to roughly max_bytes of audio.
+	One cache can be shared by every song of a module rendered with the same settings.
+	'''
+
+	def __init__(self, max_bytes=64*1024*1024):
+
+		self.max_bytes = max_bytes
+		self.size      = 0
+		self.entries   = collections.OrderedDict() # key -> (ticks, exit state, size)
+
+		self.hits   = 0
+		self.misses = 0
+
+
+	def get(self, key):
+
+		try:
+			entry = self.entries[key]
+		except KeyError:
+			self.misses += 1
+			return None
+
+		self.entries.move_to_end(key)
+		self.hits += 1
+		return entry
+
+
+	def put(self, key, ticks, exit_state):
+
+		# rough size of the rendered ticks; lists of floats cost about as much as float64 arrays
+		size = sum(getattr(tick, "nbytes", len(tick)*8) for tick in ticks)
+		if size > self.max_bytes:
+			return
+
+		if key in self.entries:
+			self.size -= self.entries.pop(key)[2]
+
+		self.entries[key] = (ticks, exit_state, size)
+		self.size += size
+
+		while self.size > self.max_bytes:
+			self.size -= self.entries.popitem(last=False)[1][2]
+
+
+	def clear(self):
+		self.entries.clear()
+		self.size = 0
+
+
+def get_span_timing(replayer_obj, sequencer_rows, loops):
+
+	'''
+	How the sequencer runs from now until the next position starts, one entry per tick:
+	(speed[0] while the channels tick, step read on that tick or None). The last entry is
+	the tick that reads the next position's first row.
+	Returns None if the render stops (song end or loop count reached) before that.
+	'''
+
+	speed       = tuple(replayer_obj.speed)
+	speed_timer = replayer_obj.speed_timer
+	position    = replayer_obj.cur_pat
+	step        = replayer_obj.cur_step
+	loop_count  = replayer_obj.loop_count
+
+	step_count     = replayer_obj.step_count
+	position_count = replayer_obj.pattern_count
+
+	ticks = list()
+
+	while True:
+
+		if speed[0] == 0:
+			return None # the render loop stops here
+
+		channel_speed = speed[0]
+		read = None
+
+		if speed_timer <= 0:
+
+			if step == 0:
+				ticks.append((channel_speed, None))
+				return tuple(ticks)
+
+			new_speed, skip = sequencer_rows.get(position*step_count + step, (None, False))
+			if new_speed != None:
+				speed = new_speed
+
+			read  = step
+			step += 1
+			speed = speed[::-1]
+			speed_timer = speed[0]
+
+			if step >= step_count or skip:
+				step = 0
+				position += 1
+				if position >= position_count:
+					position = replayer_obj.restart_pos
+					loop_count += 1
+
+		speed_timer -= 1
+		ticks.append((channel_speed, read))
+
+		if loop_count >= loops+1:
+			return None
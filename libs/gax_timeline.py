@@ -0,0 +1,81 @@
+from .shinen_gax import step_command
+
+'''
+Flattened sequencer data for the replayer.
+GAX songs are stored as an order list per channel pointing into shared patterns of
+step_command objects. The replayer reads one row (one step on every channel) at a time,
+so the song is laid out once as a flat list of events in playback order, with the
+order list's transpose already looked up and empty steps left out.
+'''
+
+
+class song_timeline:
+
+	'''
+	Every row of a song (position, step) as a run of events.
+
+	The events of row r (r = position*step_count + step) are row_start[r] to row_start[r+1]-1
+	in the flat lists channel, note, instrument, effect, param and transpose (all plain ints),
+	in channel order. steps holds the original step_command of each event.
+	order[position] is the (pattern, transpose) of every channel at that position.
+
+	Build it once per song (the replayer does this) and rebuild it after editing the
+	patterns or the order list.
+	'''
+
+	def __init__(self, song_data):
+
+		properties = song_data.get_properties()
+		order_list = song_data.get_order_list()
+		patterns   = song_data.get_patterns()
+
+		self.step_count     = properties.step_count
+		self.position_count = properties.song_length
+		self.channel_count  = properties.channel_count
+
+		self.order = [tuple(tuple(order_line[position]) for order_line in order_list)
+					  for position in range(self.position_count)]
+
+		self.empty_step = step_command() # stands in for every step that was left out
+
+		self.row_start  = list()
+		self.channel    = list()
+		self.note       = list()
+		self.instrument = list()
+		self.effect     = list()
+		self.param      = list()
+		self.transpose  = list()
+		self.steps      = list()
+
+		for position in range(self.position_count):
+			for step in range(self.step_count):
+
+				self.row_start.append(len(self.channel))
+
+				for ch in range(self.channel_count):
+
+					pattern_idx, transpose = self.order[position][ch]
+					step_data = patterns[pattern_idx][step]
+
+					if step_data.semitone == 0 and step_data.instrument == 0 and step_data.effect_type.value == 0:
+						continue # empty step; only resets the slides, which happens on every row anyway
+
+					self.channel.append(ch)
+					self.note.append(step_data.semitone)
+					self.instrument.append(step_data.instrument)
+					self.effect.append(step_data.effect_type.value)
+					self.param.append(step_data.effect_param)
+					self.transpose.append(transpose)
+					self.steps.append(step_data)
+
+		self.row_start.append(len(self.channel))
+
+
+	def get_row(self, position, step):
+		return position*self.step_count + step
+
+
+	def get_events(self, position, step):
+		# range of event indices for one row
+		row = self.get_row(position, step)
+		return range(self.row_start[row], self.row_start[row+1])
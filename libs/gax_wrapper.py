@@ -1,5 +1,7 @@
 from .shinen_gax   import *
 from .gax_replayer import channel, replayer
+from .gax_render   import tick_channels
+from .gax_realtime import realtime_player
 from .calc_mem     import get_ram_usage
 import pyaudio
 
@@ -9,17 +11,21 @@ import pyaudio
 class gax_replayer:
 
 	def __init__(self, gax_mus_object, gax_fx_object = None, 
-		song_index = 0, mixrate_override = 0, fps = 60):
+		song_index = 0, mixrate_override = 0, fps = 60, engine = None,
+		realtime = False, latency = 0.1, flush_time = 0.02):
+
+		# realtime: play through a callback stream, with the ticks rendered ahead on a
+		# background thread (see gax_realtime) instead of calling GAX_play every tick.
+		# latency is how far ahead (in seconds) it renders, flush_time how long a change
+		# (sound effects, volumes, pause, stop, switching songs...) may take to be heard
 
 		self.p = pyaudio.PyAudio()
 
 		self.module_data = gax_mus_object
+		self.fx_data     = gax_fx_object
+		self.engine      = engine
 
-		if gax_fx_object is not None:
-			self.vars = replayer(self.module_data, song_idx=song_index, 
-			allocate_fxch=True, fx_obj=gax_fx_object) #default: grab song #0
-		else:
-			self.vars = replayer(self.module_data, song_idx=song_index) #default: grab song #0
+		self.vars = self.new_replayer(song_index) #default: grab song #0
 		
 		if mixrate_override > 0:
 			self.mixing_rate = mixrate_override
@@ -34,8 +40,29 @@ class gax_replayer:
 		self.maj_version = 3
 		self.min_version = 5
 
-		self.stream = self.p.open(format=pyaudio.paInt8,
-		channels=1, rate=self.mixing_rate, output=True)	
+		self.paused  = False # GAX_pause
+		self.stopped = False # GAX_stop
+
+		if not realtime:
+			self.player = None
+			self.stream = self.p.open(format=pyaudio.paInt8,
+			channels=1, rate=self.mixing_rate, output=True)	
+		else:
+			self.player = realtime_player(self.render_tick, self.mixing_rate, latency=latency,
+				max_tick_size=int(self.mixing_rate/self.fps),
+				get_state=self.get_snapshot, set_state=self.restore_snapshot, flush_time=flush_time)
+			# a callback period well under flush_time, so a flush starts right away
+			self.stream = self.p.open(format=pyaudio.paInt8,
+			channels=1, rate=self.mixing_rate, output=True,
+			frames_per_buffer=max(64, int(self.mixing_rate*flush_time/4)),
+			stream_callback=self.stream_callback, start=False)
+
+
+	def new_replayer(self, song_index):
+		if self.fx_data is not None:
+			return replayer(self.module_data, song_idx=song_index,
+			allocate_fxch=True, fx_obj=self.fx_data, engine=self.engine)
+		return replayer(self.module_data, song_idx=song_index, engine=self.engine)
 
 
 	## useful functions
@@ -46,6 +73,59 @@ class gax_replayer:
 	def get_current_step(self):
 		return self.vars.cur_step
 
+	def render_tick(self):
+		# one tick as signed 8-bit PCM, without writing it anywhere
+		if self.vars.speed[0] == 0 or self.stopped:
+			return None # the song is over
+
+		tick_channels(self.vars, self.module_data, self.mixing_rate, self.fps,
+			gain=self.gain,
+			major_version=self.maj_version,
+			minor_version=self.min_version)
+
+		return self.vars.tick(None, debug=True, export=True)
+
+
+	## realtime playback
+
+	def start(self):
+
+		# primes the buffer, then lets the device pull from it
+		self.player.fill()
+		self.player.start()
+		self.stream.start_stream()
+
+	def close(self):
+
+		if self.player != None:
+			self.stream.stop_stream()
+			self.player.stop()
+
+		self.stream.close()
+
+	def render(self, sample_count):
+		# the pull API, decoupled from the tick size: the next sample_count samples
+		return self.player.render(sample_count)
+
+	def stream_callback(self, in_data, frame_count, time_info, status):
+		# keeps going (with silence) after the song ends, so it can be restarted or switched
+		return (self.player.render(frame_count), pyaudio.paContinue)
+
+	def get_snapshot(self):
+		return self.vars.get_snapshot()
+
+	def restore_snapshot(self, snapshot):
+		self.vars.restore_snapshot(snapshot)
+
+	def run_command(self, command, fade=True):
+		# applies a change to self.vars between two ticks. in realtime mode it runs on the render
+		# thread, after the buffered audio gets flushed, so it's heard within flush_time;
+		# fade is for the transport controls, everything else is spliced in without one
+		if self.player != None:
+			self.player.request(command, fade=fade)
+		else:
+			command()
+
 
 	# API reimplementations
 
@@ -57,30 +137,40 @@ class gax_replayer:
 			fx_channels  = self.fxch_count)
 
 	## GAX2_init
+
+	def GAX2_init(self, song_index = 0):
+
+		# (re)starts playback with another song of the module, like calling
+		# GAX2_init again with new music. stays paused if it was paused
+
+		def switch_song():
+			self.vars    = self.new_replayer(song_index)
+			self.stopped = False
+
+		self.run_command(switch_song)
+
 	## GAX2_jingle
 	## GAX_irq
 
 	def GAX_play(self, debug = False):
 
-		for ch in range(self.vars.num_channels):
-			self.vars.channels[ch].tick(ch,self.vars,
-				self.module_data.instrument_set, 
-				self.module_data.wave_set.wave_bank, 
-				self.stream, self.mixing_rate, self.fps,
-				gain=self.gain,
-				major_version=self.maj_version,
-				minor_version=self.min_version)
-
-		if self.vars.num_fx_channels:
-			for ch in range(self.vars.num_channels, 
-				self.vars.num_channels+self.vars.num_fx_channels):
-				self.vars.channels[ch].tick(ch,self.vars,
-					self.vars.fx_data.instrument_set, 
-					self.vars.fx_data.wave_set.wave_bank, 
-					self.stream, self.mixing_rate, self.fps,
-					gain=self.gain,
-					major_version=self.maj_version,
-					minor_version=self.min_version)
+		if self.player != None:
+			raise Exception("GAX_play can't be used in realtime mode; use start() instead")
+
+		if self.paused or self.stopped:
+			# nothing gets rendered, but the stream still gets a tick (of silence) so the caller keeps its pace
+			silence = bytes(int(self.mixing_rate/self.fps))
+			self.stream.write(silence)
+			if debug:
+				return silence
+			return
+
+		tick_channels(self.vars, self.module_data, self.mixing_rate, self.fps,
+			gain=self.gain,
+			major_version=self.maj_version,
+			minor_version=self.min_version,
+			stream=self.stream)
+
 		try:
 			if not debug:
 				self.vars.tick(self.stream)
@@ -89,7 +179,18 @@ class gax_replayer:
 		except OSError as e:
 			raise Exception('Audio output error')
 
-	## GAX_stop
+	def GAX_stop(self):
+
+		# stops the music and every sound effect. GAX2_init starts playing again
+
+		def stop():
+			self.stopped = True
+			if self.vars.num_fx_channels:
+				for i in range(self.vars.num_fx_channels):
+					self.vars.stop_sound(i)
+
+		self.run_command(stop)
+
 	## GAX2_new_fx
 		
 	def GAX_fx(self, fxid):
@@ -102,40 +203,55 @@ class gax_replayer:
 		prio2   = -1
 
 		if fxid < 256:
-			for i in range(self.vars.num_channels):
-				prio1 = self.vars.channels[self.vars.num_channels+fxch].priority
-				if prio1 <= prio2:
-					curfxch = i
-					prio2   = prio1
-
-			self.vars.play_sound(fxch=fxch, fx_idx=fxid)
-			self.vars.channels[self.vars.num_channels+fxch].priority = 0
+			if self.vars.num_fx_channels:
+				for i in range(self.vars.num_fx_channels):
+					prio1 = self.vars.channels[self.vars.num_channels+i].priority
+					if prio1 <= prio2:
+						curfxch = i
+						prio2   = prio1
+
+			def play():
+				self.vars.play_sound(fxch=curfxch, fx_idx=fxid)
+				self.vars.channels[self.vars.num_channels+curfxch].priority = 0
+
+			self.run_command(play, fade=False)
 		else:
 			raise Exception('Playback of speech is not supported')
 
 		return curfxch
 
 
-	def GAX_fx_note(self, fxch, note=0):
+	def set_fx_note(self, fxch, note):
 		if (note < 3821 and fxch > -1 
 			and fxch < self.fxch_count):
 			if self.vars.channels[self.vars.num_channels+fxch].instrument_idx:
 				self.vars.channels[self.vars.num_channels+fxch].semitone = note/32
 				self.vars.channels[self.vars.num_channels+fxch].is_fixed = False
 
+	def GAX_fx_note(self, fxch, note=0):
+		self.run_command(lambda: self.set_fx_note(fxch, note), fade=False)
+
 	def GAX_fx_ex(self, fxid, fxch, prio=0, note=0):
-		self.vars.play_sound(fxch=fxch, fx_idx=fxid)
-		self.GAX_fx_note(fxch, note)
+
+		def play():
+			self.vars.play_sound(fxch=fxch, fx_idx=fxid)
+			self.set_fx_note(fxch, note)
+
+		self.run_command(play, fade=False)
 
 	def GAX_fx_status(self, fxch):
 		return self.vars.channels[self.vars.num_channels+fxch].instrument_idx
 
 	def GAX_stop_fx(self, fxch):
-		if fxch != -1:
-			for i in range(self.vars.num_fx_channels):
-				self.vars.stop_sound(i)
-		elif (fxch < self.vars.num_fx_channels and fxch >= 0):
-			self.vars.stop_sound(fxch)
+
+		def stop():
+			if fxch != -1:
+				for i in range(self.vars.num_fx_channels):
+					self.vars.stop_sound(i)
+			elif (fxch < self.vars.num_fx_channels and fxch >= 0):
+				self.vars.stop_sound(fxch)
+
+		self.run_command(stop, fade=False)
 
 	## GAX_backup_fx
 	## GAX_restore_fx
@@ -146,11 +262,14 @@ class gax_replayer:
 		if corrected_vol > 1.0:
 			corrected_vol = 1
 
-		if ch == -1:
-			for i in range(self.vars.num_channels):
-				self.vars.channels[i].mix_volume = corrected_vol
-		else:
-			self.vars.channels[ch].mix_volume = corrected_vol
+		def set_volume():
+			if ch == -1:
+				for i in range(self.vars.num_channels):
+					self.vars.channels[i].mix_volume = corrected_vol
+			else:
+				self.vars.channels[ch].mix_volume = corrected_vol
+
+		self.run_command(set_volume, fade=False)
 
 	def GAX_set_fx_volume(self, fxch, vol):
 
@@ -158,14 +277,43 @@ class gax_replayer:
 		if corrected_vol > 1.0:
 			corrected_vol = 1
 
-		if fxch == -1:
-			for i in range(self.vars.num_fx_channels):
-				self.vars.channels[self.vars.num_channels+i].mix_volume = corrected_vol
-		elif (fxch > -2 and fxch < self.vars.num_fx_channels):
-			self.vars.channels[self.vars.num_channels+fxch].mix_volume = corrected_vol
+		def set_volume():
+			if fxch == -1:
+				for i in range(self.vars.num_fx_channels):
+					self.vars.channels[self.vars.num_channels+i].mix_volume = corrected_vol
+			elif (fxch > -2 and fxch < self.vars.num_fx_channels):
+				self.vars.channels[self.vars.num_channels+fxch].mix_volume = corrected_vol
+
+		self.run_command(set_volume, fade=False)
+
+	def GAX_pause(self):
+
+		# stops all sound output, music and FX; everything resumes from where it stopped.
+		# in realtime mode the buffered audio is kept (and fades out / back in)
+
+		self.paused = True
+		if self.player != None:
+			self.player.pause()
+
+	def GAX_pause_music(self):
+
+		# the music stops (and stops being rendered), sound effects keep playing
+
+		def pause_music():
+			self.vars.music_paused = True
+
+		self.run_command(pause_music)
+
+	def GAX_resume(self):
+
+		self.paused = False
+		if self.player != None:
+			self.player.resume()
+
+	def GAX_resume_music(self):
+
+		def resume_music():
+			self.vars.music_paused = False
 
-	## GAX_pause
-	## GAX_pause_music
-	## GAX_resume
-	## GAX_resume_music
+		self.run_command(resume_music)
 
@@ -17,5 +17,10 @@ def get_period(note):
 def get_freq(period):
 	return 8363 * pow(2, (4608 - period) / 768)
 	
+# signed <-> unsigned 8-bit, for bytes.translate
+sign_flip_table = bytes((i+128)%256 for i in range(256))
+
 def sign_flip(sample):
-	return bytes((i+128)%256 for i in sample)
\ No newline at end of file
+	if isinstance(sample, (bytes, bytearray, memoryview)):
+		return bytes(sample).translate(sign_flip_table)
+	return bytes((i+128)%256 for i in sample)
@@ -0,0 +1,151 @@
+import wave
+import queue
+import struct
+import threading
+
+from .general import sign_flip
+
+'''
+Streaming .wav output, so long renders never have to sit in memory as one buffer.
+'''
+
+
+# sample formats that go into a .wav file exactly as they're rendered: (sample width, format tag)
+wav_formats = {
+	"uint8":   (1, 1),
+	"int16":   (2, 1),
+	"float32": (4, 3)  # IEEE float
+}
+
+
+class wav_stream_writer:
+
+	'''
+	Writes PCM to a .wav file one block at a time, as the blocks get rendered.
+	8-bit blocks are passed in as signed PCM (what the replayer puts out) and are
+	flipped to unsigned per block, since that's what .wav expects.
+
+	Options:
+		threaded: do the conversion and file I/O on a writer thread, overlapping with rendering.
+		queue_size: how many blocks the writer thread may fall behind before write_block waits.
+		sample_format: one of wav_formats (render with the same output_format). The blocks then
+			get written as they are, with no conversion; overrides sample_width.
+	'''
+
+	def __init__(self, path, rate, sample_width=1, channels=1, threaded=False, queue_size=256,
+		sample_format=None):
+
+		format_tag = 1
+		if sample_format != None:
+			if sample_format not in wav_formats:
+				raise ValueError("Can't write {} samples to a .wav file".format(sample_format))
+			sample_width, format_tag = wav_formats[sample_format]
+
+		self.path          = path
+		self.rate          = rate
+		self.channels      = channels
+		self.format_tag    = format_tag
+		self.sample_width  = sample_width
+		self.sample_format = sample_format
+
+		if format_tag == 1:
+			self.wav_file = wave.open(path, mode="wb")
+			self.wav_file.setnchannels(channels)
+			self.wav_file.setsampwidth(sample_width)
+			self.wav_file.setframerate(rate)
+			self.raw_file = None
+		else:
+			# the wave module only writes integer PCM headers, so this one writes its own
+			self.wav_file  = None
+			self.raw_file  = open(path, "wb")
+			self.data_size = 0
+			self.write_float_header()
+		self.blocks       = None
+		self.thread       = None
+		self.error        = None
+
+		if threaded:
+			self.blocks = queue.Queue(maxsize=queue_size)
+			self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+			self.thread.start()
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+	def convert_block(self, block):
+		if self.sample_width == 1 and self.sample_format == None:
+			return sign_flip(block)
+		return block
+
+
+	def write_float_header(self):
+
+		# WAVE_FORMAT_IEEE_FLOAT: an 18 byte "fmt " chunk (cbSize = 0) and a "fact" chunk
+		# with the number of sample frames, both needed for non-PCM formats
+		block_align = self.channels * self.sample_width
+
+		self.raw_file.seek(0)
+		self.raw_file.write(struct.pack("<4sI4s", b"RIFF", 50 + self.data_size, b"WAVE"))
+		self.raw_file.write(struct.pack("<4sIHHIIHHH", b"fmt ", 18, self.format_tag, self.channels,
+			self.rate, self.rate*block_align, block_align, self.sample_width*8, 0))
+		self.raw_file.write(struct.pack("<4sII", b"fact", 4, self.data_size // block_align))
+		self.raw_file.write(struct.pack("<4sI", b"data", self.data_size))
+
+
+	def write_raw(self, block):
+		# neither of these touch the header while writing; close() patches it once at the end
+		if self.raw_file is None:
+			self.wav_file.writeframesraw(self.convert_block(block))
+		else:
+			block = memoryview(self.convert_block(block))
+			self.raw_file.write(block)
+			self.data_size += block.nbytes
+
+
+	def writer_loop(self):
+		while True:
+			block = self.blocks.get()
+			if block is None:
+				break
+			if self.error is None:
+				try:
+					self.write_raw(block)
+				except Exception as e:
+					self.error = e # raised again on the rendering thread
+
+
+	def write_block(self, block):
+
+		if self.error is not None:
+			raise self.error
+
+		if self.thread is None:
+			self.write_raw(block)
+		else:
+			# blocks have to stay untouched until the writer thread gets to them
+			self.blocks.put(bytes(block))
+
+
+	def close(self):
+
+		if self.thread is not None:
+			self.blocks.put(None)
+			self.thread.join()
+			self.thread = None
+
+		if self.wav_file is not None:
+			self.wav_file.close()
+			self.wav_file = None
+
+		elif self.raw_file is not None:
+			self.write_float_header()
+			self.raw_file.close()
+			self.raw_file = None
+
+		if self.error is not None:
+			raise self.error